@@ -1,40 +1,371 @@
 import os 
 import sys
 import importlib.util
-from openai import OpenAI  
 import json
-from mcp_utils import MCPServerManager, load_mcp_conf, exec_mcp_tools
+import time
+import asyncio
+import threading
+import itertools
+import argparse
+import contextlib
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from mcp_utils import MCPServerManager, ToolListCache, shared_broker, load_mcp_conf, exec_mcp_tools
+from context_utils import ContextManager
+from tool_utils import tools_schema, compact_desc, full_desc, DescCache, OnceLoader, LazyTool, ToolIndex
+from result_utils import ResultShaper
+from cache_utils import ToolCache, ResponseCache
+from batch_utils import run_batch
+from plan_utils import PLAN_PREFIX, PLAN_PROMPT, parse_plan, resolve_refs
+from client_utils import RetryPolicy, RateLimiter, shared_pool
+from worker_utils import WorkerPool
 
 
+# prefix of replies in which ai asks for a tool execution
+EXEC_PREFIX = "YLDEXECUTE:"
+# prefix of messages feeding tool results back to ai
+RESULT_PREFIX = "执行结果："
+# replies starting with these are tool steps, never shown to the user
+TOOL_PREFIXES = (EXEC_PREFIX, PLAN_PREFIX)
+
+
+# merge pieces of streamed tool calls into tool_calls: list of assistant-message tool calls
+# pieces are indexed, their names and arguments arrive in parts
+def merge_tool_calls(tool_calls, pieces):
+    for call in pieces or []:
+        while len(tool_calls) <= call.index:
+            tool_calls.append({"id": "", "type": "function", "function": {"name": "", "arguments": ""}})
+        if call.id:
+            tool_calls[call.index]["id"] = call.id
+        if call.function and call.function.name:
+            tool_calls[call.index]["function"]["name"] += call.function.name
+        if call.function and call.function.arguments:
+            tool_calls[call.index]["function"]["arguments"] += call.function.arguments
+
+
+# token counts of a reply from response.usage
+# cache hits are 'prompt_cache_hit_tokens' on deepseek, 'prompt_tokens_details.cached_tokens' on openai
+def usage_record(usage):
+    if usage is None:
+        return {}
+    hit = getattr(usage, "prompt_cache_hit_tokens", None)
+    if hit is None and getattr(usage, "prompt_tokens_details", None):
+        hit = usage.prompt_tokens_details.cached_tokens
+    return {
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+        "cache_hit_tokens": hit or 0,
+    }
+
+
+# one line summary of the step records of a turn, see AI.get_metrics
+def summarize_turn(records):
+    api = sum(r.get("api_time", 0) for r in records)
+    tools = sum(t.get("time") or 0 for r in records for t in r.get("tools", []))
+    prompt = sum(r.get("prompt_tokens", 0) for r in records)
+    hit = sum(r.get("cache_hit_tokens", 0) for r in records)
+    completion = sum(r.get("completion_tokens", 0) for r in records)
+    return (f"{len(records)} 步，API {api:.2f}s，工具 {tools:.2f}s，"
+            f"prompt {prompt} tokens（缓存命中 {hit}），completion {completion} tokens")
+
+
+# assistant message of a complete (not streamed) reply from the api
+def reply_message(message):
+    msg = {"role": "assistant", "content": message.content or ""}
+    if message.tool_calls:
+        msg["tool_calls"] = [{
+            "id": call.id,
+            "type": "function",
+            "function": {"name": call.function.name, "arguments": call.function.arguments}
+        } for call in message.tool_calls]
+    return msg
+
+
+# collects a streamed reply and forwards its deltas to on_delta
+# replies of tool steps (starting with one of TOOL_PREFIXES) are never forwarded,
+# so the callback only sees text meant for the user
+# on_exec_line: optional callback, gets every YLDEXECUTE line of a tool step as soon as the line is complete
+class ReplyGate:
+    def __init__(self, on_delta, on_exec_line=None):
+        self.on_delta = on_delta
+        self.on_exec_line = on_exec_line
+        self.reply = ""
+        # None until enough text arrived to tell a tool step from an answer
+        self.forwarding = None
+        # chars of reply already passed to on_exec_line
+        self.taken = 0
+        # set once a line of a tool step was not a directive, the rest of the reply is dropped
+        self.stopped = False
+
+    # returns False when the rest of the stream is not wanted any more
+    def feed(self, delta):
+        self.reply += delta
+        if self.forwarding:
+            self.on_delta(delta)
+        elif self.forwarding is None and not any(len(self.reply) < len(p) and p.startswith(self.reply) for p in TOOL_PREFIXES):
+            self.forwarding = not self.reply.startswith(TOOL_PREFIXES)
+            if self.forwarding:
+                # flush the text held back so far
+                self.on_delta(self.reply)
+        
+        if self.on_exec_line and self.reply.startswith(EXEC_PREFIX):
+            return self.take_lines()
+        return True
+
+    # pass the complete lines of a YLDEXECUTE step to on_exec_line
+    # final: the reply is over, its last line is complete too
+    # returns False at the first line which is not a directive, the reply is cut before it;
+    # an unfinished line is judged as soon as its start tells
+    def take_lines(self, final=False):
+        while not self.stopped and self.taken < len(self.reply):
+            end = self.reply.find("\n", self.taken)
+            complete = end >= 0 or final
+            if end < 0:
+                end = len(self.reply)
+            line = self.reply[self.taken:end].strip()
+            if line and not line.startswith(EXEC_PREFIX):
+                if complete or not EXEC_PREFIX.startswith(line):
+                    print(f"[Warning] 工具指令后出现多余输出，已丢弃：{line[:50]}")
+                    self.reply = self.reply[:self.taken].rstrip()
+                    self.stopped = True
+                break
+            if not complete:
+                break
+            if line:
+                self.on_exec_line(line)
+            self.taken = end + 1
+        return not self.stopped
+
+    # the assistant message of the finished reply
+    def message(self, tool_calls=None):
+        # short replies may end before the decision is made
+        if self.forwarding is None and self.reply:
+            self.on_delta(self.reply)
+        if self.on_exec_line and self.reply.startswith(EXEC_PREFIX):
+            self.take_lines(final=True)
+        msg = {"role": "assistant", "content": self.reply}
+        if tool_calls:
+            msg["tool_calls"] = tool_calls
+        return msg
+
+
+# raised in the agent loop once its CancelToken is cancelled
+# partial: text of the answer received before the cancellation
+class Cancelled(Exception):
+    def __init__(self, partial=""):
+        super().__init__("已取消")
+        self.partial = partial
+
+
+# cooperative cancellation of one process_user_inp, cancel() may be called from any thread
+# the loop checks it between steps; http requests and tool waits are cut short through on_cancel callbacks
+class CancelToken:
+    def __init__(self):
+        self.event = threading.Event()
+        self.callbacks = []
+        self.lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    def cancel(self):
+        with self.lock:
+            if self.event.is_set():
+                return
+            self.event.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"[Warning] 取消时出错：{e}")
+
+    # run callback on cancel, at once if already cancelled
+    # returns a function removing the callback again
+    def on_cancel(self, callback):
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(callback)
+                return lambda: self.remove(callback)
+        callback()
+        return lambda: None
+
+    def remove(self, callback):
+        with self.lock:
+            if callback in self.callbacks:
+                self.callbacks.remove(callback)
+
+    def check(self, partial=""):
+        if self.event.is_set():
+            raise Cancelled(partial)
+
+    # result of a concurrent future, waiting at most timeout seconds (None: no limit)
+    # raises Cancelled as soon as the token is cancelled, the future itself is left alone
+    def wait(self, future, timeout=None):
+        done = threading.Event()
+        future.add_done_callback(lambda f: done.set())
+        remove = self.on_cancel(done.set)
+        try:
+            done.wait(timeout)
+        finally:
+            remove()
+        if future.done():
+            return future.result()
+        self.check()
+        raise FutureTimeout()
+
+
+# run func in a daemon thread of its own, returns a future of its result
+# for blocking calls which can only be abandoned, not interrupted
+def run_detached(func, *args, **kwargs):
+    future = Future()
+    def run():
+        try:
+            future.set_result(func(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
 
 # main class of AI, encapsulated from ./console.py on 10/01/26
 class AI:
     def __init__(self, mcp_paths=None, api_key=None,
-                 system_prompt=None, temperature=1.0):
+                 system_prompt=None, temperature=1.0, context_budget=48000, tool_mode="text",
+                 tool_workers=4, tool_timeout=60, result_chars=4000,
+                 tool_cache=True, tool_cache_dir=".cache/tools", lazy_tools=True, tool_top_k=8,
+                 base_url="https://api.deepseek.com", default_tools=True, max_retries=4, max_connections=20,
+                 response_cache=None, rpm=None, model="deepseek-chat", routes=None, reroute_final=False,
+                 plan_mode=False, tool_processes=None, tool_recycle=200, tool_desc="compact", mcp_cache=True,
+                 mcp_broker=True):
         # properties of chat: mcp_paths, api_key, system_prompt, temperature are required to init
+        # context_budget: estimated tokens allowed for the messages of one request, None for no limit
+        # tool_mode: "text" for YLDEXECUTE replies, "native" for the api's function calling
+        # tool_workers: max tools running at once, tool_timeout: seconds allowed for one tool
+        # result_chars: size cap of one tool result in conv_his, longer ones are paged by read_result
+        # tool_cache: memoize deterministic tools, tool_cache_dir: None to keep them in memory only
+        # lazy_tools: register tools from descriptions cached by a previous run,
+        #             a module is imported / a server started on the first call of its tools
+        # tool_top_k: tools described in full each turn, picked by relevance to the user's input;
+        #             the others only get a catalog line. None describes all tools in full
+        #             (text mode only: native mode always sends every schema, a tool left out cannot be called)
+        # base_url: the chat completions endpoint, any openai compatible server works
+        # default_tools: also load ./tools/ocr.py and ./tools/mcp_config.json
+        # max_retries: retries of a failed request (429, 5xx, network), see client_utils.RetryPolicy
+        # max_connections: requests in flight at once over the connection pool shared by all instances,
+        #                  only the first instance of the process sets it
+        # response_cache: path of a sqlite file replaying replies of identical requests, None to disable;
+        #                 meant for scripted workflows at temperature 0
+        # rpm: max requests per minute of this instance over all its conversations, None for no limit
+        # model: model of every request, unless routes say otherwise
+        # routes: {"tool": {"model", "temperature"}, "final": {...}}, chosen per step by pick_route
+        #         "tool" serves steps right after a tool step, which mostly just pick the next tool;
+        #         "final" serves the first step of a turn; missing keys fall back to model / temperature
+        # reroute_final: an answer to the user coming from the "tool" route is asked again from "final";
+        #                off by default, it costs one more request and the latency of both models
+        # plan_mode: let ai send a whole YLDPLAN of dependent tool calls at once (text mode),
+        #            it runs locally and comes back in one result message, see run_plan
+        # tool_processes: host python tool files in this many worker processes instead of importing them,
+        #                 a call over tool_timeout kills its worker; None runs tools in this process
+        # tool_recycle: calls served by a worker process before it is replaced
+        # tool_desc: "compact" describes each tool in one line built from its signature (text mode),
+        #            "full" pastes its docstring as written
+        # mcp_cache: register MCP servers from their last tools/list and start them in the background,
+        #            see mcp_utils.ToolListCache; config files then skip lazy_tools, whose descriptions
+        #            would only be refreshed when the config file itself changes
+        # mcp_broker: share MCP servers through mcp_broker.py when it is running, instead of starting them here
+        
+        # (label, seconds) of every startup stage, see print_startup_report
+        self.startup_times = []
+        init_start = time.time()
         
         # mcp_paths, system_prompt can be null
         self.mcp_paths = mcp_paths or []
         self.api_key = api_key # api_key MUST be available
+        self.base_url = base_url
+        self.default_tools = default_tools
+        self.tool_mode = tool_mode
+        self.plan_mode = plan_mode
         self.system_prompt = system_prompt or self.get_default_system_prompt() # default if not set
         self.temperature = temperature
+        self.model = model
+        self.routes = {"tool": {}, "final": {}}
+        self.routes.update(routes or {})
+        self.reroute_final = reroute_final
         self.funcs = {}
+        # tool list changes of MCP servers warming up while tools are being loaded wait here,
+        # see update_mcp_tools; None when no loading is going on
+        self.funcs_lock = threading.Lock()
+        self.deferred_tool_updates = None
+        # function calling schemas of self.funcs, only sent in native mode
+        self.tool_schemas = []
+        # descriptions of self.funcs in the system prompt: {func name: (function, text)}, see describe_tool
+        self.tool_desc = tool_desc
+        self.tool_descs = {}
+        
+        # one record per step of the agent loop, see get_metrics
+        self.metrics = []
+        self.turn_ids = itertools.count(1)
+        self.last_turn = None
+        
+        # BM25 index over self.funcs, selects the tools described each turn
+        self.tool_top_k = tool_top_k
+        self.tool_index = None
+        
+        # tools asked in one reply run together on this pool
+        # tool_timeouts: {function name: seconds}, overrides tool_timeout for slow tools
+        self.tool_pool = ThreadPoolExecutor(max_workers=tool_workers, thread_name_prefix="tool")
+        self.tool_timeout = tool_timeout
+        self.tool_timeouts = {}
+        
+        # worker processes running the python tools, see worker_utils.WorkerPool
+        self.worker_pool = None
+        if tool_processes:
+            self.worker_pool = WorkerPool(tool_processes, tool_timeout, self.tool_timeouts, tool_recycle)
+        
+        # shapes tool results before they enter conv_his
+        # result_shaper.limits: {function name: chars}, overrides result_chars for single tools
+        self.result_shaper = ResultShaper(result_chars)
+        
+        # results of deterministic tools, see cache_utils.DEFAULT_POLICIES
+        self.tool_cache = ToolCache(tool_cache_dir) if tool_cache else None
+        
+        # replies of the api, see cache_utils.ResponseCache
+        self.response_cache = ResponseCache(response_cache) if response_cache else None
+        
+        self.lazy_tools = lazy_tools
+        self.desc_cache = DescCache() if lazy_tools else None
+        self.mcp_tool_cache = ToolListCache() if mcp_cache else None
+        self.mcp_broker = mcp_broker
         self.conv_his = []
         
+        # trims conv_his to context_budget before every request
+        self.context = ContextManager(context_budget, tool_result_prefix=RESULT_PREFIX)
         
-        # OpenAI' s client instance
+        
+        # OpenAI' s client instance, on the process wide connection pool
         self.client = None
+        self.client_pool = shared_pool(max_connections=max_connections)
+        self.retry = RetryPolicy(max_retries)
+        self.rate_limiter = RateLimiter(rpm) if rpm else None
         
         # load with mcp_path (even if it is empty)
         self.load_mcp_tools()
         
         
+        start = time.time()
         self.init_ai_client()
+        self.startup_times.append(("初始化 API 客户端", time.time() - start))
         
         self.reset_conversation()
         
+        self.startup_times.append(("初始化总计", time.time() - init_start))
+        self.print_startup_report()
+        
     # return default system_prompt for agents
     def get_default_system_prompt(self):
+        if self.tool_mode == "native":
+            return self.get_native_system_prompt()
         return """
         你是一个AI助手，可以直接执行命令和调用可用工具。
 
@@ -64,6 +395,7 @@ class AI:
         【调用格式】
         - `YLDEXECUTE: 工具名 ￥| 参数1 ￥| 参数2 ￥| ...`
         - 或直接系统命令：`YLDEXECUTE: 命令 ￥| 参数1 ￥| 参数2 ￥| ...`
+        - 多个互不依赖的操作（如识别多个文件、读取多个网页）可以每行输出一条YLDEXECUTE指令，它们会被同时执行
 
 
 
@@ -89,7 +421,7 @@ class AI:
         【多步操作规则】
         1. 只有在用户明确要求多个操作时，才执行多步
         2. 每次只执行一步，等待用户说"继续"再执行下一步
-        3. 每一步只输出一个YLDEXECUTE指令，无任何其他文本
+        3. 每一步只输出YLDEXECUTE指令（互不依赖的操作可以多行），无任何其他文本
         4. 如果用户没有明确要求多步，不要自行分解任务
 
         【错误处理】
@@ -99,6 +431,17 @@ class AI:
         请严格遵守以上规则，确保响应简洁、准确，符合用户实际需求。
     """
 
+    # system_prompt for native mode, tools and their args are described by the api's tool schemas
+    def get_native_system_prompt(self):
+        return """
+        你是一个AI助手，可以调用提供的工具完成用户的操作请求。
+
+        1. 用户明确要求操作（查询、搜索、文件操作等）时调用工具，陈述事实或普通对话时直接回答
+        2. 互不依赖的多个操作可以在同一次回复中同时调用
+        3. 工具执行失败时，检查参数后重试或直接告知用户"操作失败"
+        4. 任务完成后，简洁地总结结果
+    """
+
 
     # func loading one MCP file, *.json or *.py, , used in load_mult_mcp_mod
     def load_mcp_mod(self, mcp_path):
@@ -110,10 +453,15 @@ class AI:
             if mcp_path.endswith('.json'):
                 
                 # create a MCP manager instance, managing Server's launch, comunicate and close
-                mcp_manager = MCPServerManager()
+                mcp_manager = self.new_mcp_manager()
+                # a server registered from cache may come up with other tools
+                mcp_manager.on_tools_changed = lambda ser_name: self.update_mcp_tools(mcp_manager, ser_name)
                 
                 # tool_names is a dictionary: {function name: function obj}
-                tool_names = load_mcp_conf(mcp_path, mcp_manager) # returns a list of functions:[function name, server_name, tool name, description]
+                tool_names = load_mcp_conf(mcp_path, mcp_manager, self.mcp_tool_cache) # returns a list of functions:[function name, server_name, tool name, description]
+                # servers start in parallel, each one is listed in the startup report
+                for ser_name, seconds in mcp_manager.startup_times.items():
+                    self.startup_times.append((f"启动 MCP 服务器 {ser_name}", seconds))
                 
                 # returns {None, empty dict} if failed
                 if not tool_names:
@@ -125,29 +473,7 @@ class AI:
                 # iter from every server names 
                 # 'mcp_manager.servers' is server configure information added in 'parse_config' phase
                 for ser_name in mcp_manager.servers.keys():
-                    
-                    # get list of all informations of tools provided by server
-                    for tool in mcp_manager.tools.get(ser_name, []):
-                        # get tool name by tool information
-                        tool_name = tool.get('name', '')
-                        # make related python funcs if tools exist
-                        if tool_name:
-                            
-                            # func name = {mcp_{server name}_{tool name}} for naming conflicts
-                            func_name = f"mcp_{ser_name}_{tool_name}"
-                            def make_tool_func(name_ser, name_tool, desc):
-                                def tool_func(**kwargs):
-                                    # exec tools in ways of MCP Server Management
-                                    # args: server name, tool name, args dict
-                                    res = mcp_manager.call_tool(name_ser, name_tool, kwargs)
-                                    return json.dumps(res, ensure_ascii=False, indent=2)
-                                tool_func.__name__ = name_tool
-                                
-                                # set the property "__doc__" of functions to the description of tools
-                                # AI reads "__doc__" to know its usage
-                                tool_func.__doc__ = tool.get('description', desc)
-                                return tool_func
-                            funcs[func_name] = make_tool_func(ser_name, tool_name, tool.get('description', '无描述'))
+                    funcs.update(self.make_mcp_funcs(mcp_manager, ser_name))
                 
                 class MCPModule:
                     def __init__(self):
@@ -155,6 +481,10 @@ class AI:
                         self.manager = mcp_manager
                 return MCPModule(), funcs             
                         
+            elif self.worker_pool:
+                # for Python file hosted in worker processes, only described here
+                return None, self.worker_pool.load(mcp_path)
+            
             else:
                 # for Python file
                 
@@ -191,7 +521,8 @@ class AI:
                     attr = getattr(mcp_module, attr_name)
                     
                     # check if tools are available, filtering away protected, private, special properties
-                    if callable(attr) and not attr_name.startswith('_'):
+                    # and helpers imported by the module (e.g. urlopen)
+                    if callable(attr) and not attr_name.startswith('_') and getattr(attr, '__module__', None) == module_name:
                         # funcs[function_name] = {function object}
                         # actually, classes wil also be collected
                         funcs[attr_name] = attr
@@ -203,14 +534,136 @@ class AI:
             return None, {}
 
 
+    # make python funcs for the tools of one started MCP server
+    # returns {func name: function}
+    def make_mcp_funcs(self, mcp_manager, ser_name):
+        funcs = {}
+        
+        # get list of all informations of tools provided by server
+        for tool in mcp_manager.tools.get(ser_name, []):
+            # get tool name by tool information
+            tool_name = tool.get('name', '')
+            # make related python funcs if tools exist
+            if tool_name:
+                
+                # func name = {mcp_{server name}_{tool name}} for naming conflicts
+                func_name = f"mcp_{ser_name}_{tool_name}"
+                def make_tool_func(name_ser, name_tool, desc, schema):
+                    def tool_func(**kwargs):
+                        # exec tools in ways of MCP Server Management
+                        # args: server name, tool name, args dict
+                        res = mcp_manager.call_tool(name_ser, name_tool, kwargs)
+                        return json.dumps(res, ensure_ascii=False, indent=2)
+                    tool_func.__name__ = name_tool
+                    
+                    # set the property "__doc__" of functions to the description of tools
+                    # AI reads "__doc__" to know its usage
+                    tool_func.__doc__ = desc
+                    # args schema from tools/list, used in native mode
+                    tool_func.input_schema = schema
+                    # server of the tool, lets lazy loading start only this server
+                    tool_func.server = name_ser
+                    return tool_func
+                funcs[func_name] = make_tool_func(ser_name, tool_name, tool.get('description', '无描述'), tool.get('inputSchema'))
+        return funcs
+
+
+    # replace the tools of one server in self.funcs by the ones it lists now
+    # called from the server's startup thread, so self.funcs is swapped whole, not changed in place
+    # while tools are loading, the change is applied once loading is done, see finish_loading
+    def update_mcp_tools(self, mcp_manager, ser_name):
+        with self.funcs_lock:
+            if self.deferred_tool_updates is not None:
+                self.deferred_tool_updates.append((mcp_manager, ser_name))
+                return
+            funcs = {name: func for name, func in self.funcs.items() if getattr(func, 'server', None) != ser_name}
+            funcs.update(self.make_mcp_funcs(mcp_manager, ser_name))
+            self.funcs = funcs
+            self.refresh_tools()
+
+
+    # start loading tools: tool list changes arriving meanwhile are held back
+    def start_loading(self):
+        with self.funcs_lock:
+            if self.deferred_tool_updates is None:
+                self.deferred_tool_updates = []
+
+
+    # loading is done and self.funcs set: apply the tool list changes held back
+    def finish_loading(self):
+        with self.funcs_lock:
+            updates, self.deferred_tool_updates = self.deferred_tool_updates or [], None
+        for mcp_manager, ser_name in updates:
+            self.update_mcp_tools(mcp_manager, ser_name)
+
+
+    # MCPServerManager on the running broker if there is one (and mcp_broker is on)
+    def new_mcp_manager(self):
+        return MCPServerManager(broker=shared_broker() if self.mcp_broker else None)
+
+
+    # start one server of a MCP config file, returns the funcs of its tools
+    # used by lazy loading, on the first call of one of its tools
+    # goes through launch like load_mcp_conf: asks the broker first, timed, stopped again on failure
+    def load_mcp_server(self, mcp_path, ser_name):
+        mcp_manager = self.new_mcp_manager()
+        with open(mcp_path, 'r') as f:
+            if not mcp_manager.parse_config(f.read()):
+                return {}
+        mcp_manager.conf_path = os.path.abspath(mcp_path)
+        if mcp_manager.launch(ser_name):
+            return self.make_mcp_funcs(mcp_manager, ser_name)
+        return {}
+
+
+    # register the tools of one MCP file from desc_cache, without loading anything
+    # returns {func name: LazyTool}, empty if the file has no valid cached descriptions
+    def load_lazy_mod(self, mcp_path):
+        tools = self.desc_cache.get(mcp_path)
+        if not tools:
+            return {}
+        
+        # one loader per server (json) or for the whole module (py)
+        loaders = {}
+        funcs = {}
+        for func_name, info in tools.items():
+            ser_name = info.get("server")
+            if ser_name not in loaders:
+                if mcp_path.endswith('.json'):
+                    load = lambda s=ser_name: self.load_mcp_server(mcp_path, s)
+                    label = f"首次调用时启动 {ser_name}"
+                else:
+                    load = lambda: self.load_mcp_mod(mcp_path)[1]
+                    label = f"首次调用时加载 {os.path.basename(mcp_path)}"
+                loaders[ser_name] = OnceLoader(load, label, self.startup_times)
+            funcs[func_name] = LazyTool(func_name, info["doc"], info["schema"], loaders[ser_name], info.get("compact"))
+        print(f"[Info] 从缓存注册 {os.path.basename(mcp_path)} 的 {len(funcs)} 个工具")
+        return funcs
+
+
     # load multiple mcp files
+    # with lazy_tools, files with cached descriptions are only registered
+    # MCP config files are left to mcp_tool_cache when it is on, see load_mcp_conf
     def load_mult_mcp_mod(self, mcp_paths):
         all_funcs = {}
         all_mods = []
         
         for path in mcp_paths:
             # iter from MCP files in paths
-            mod, funcs = self.load_mcp_mod(path)
+            start = time.time()
+            mod, funcs = None, {}
+            lazy = self.lazy_tools and not (path.endswith('.json') and self.mcp_tool_cache)
+            if lazy:
+                funcs = self.load_lazy_mod(path)
+            if funcs:
+                label = f"注册 {os.path.basename(path)}（缓存）"
+            else:
+                mod, funcs = self.load_mcp_mod(path)
+                label = f"加载 {os.path.basename(path)}"
+                if funcs and lazy:
+                    self.desc_cache.put(path, funcs)
+            self.startup_times.append((label, time.time() - start))
+            
             if mod:
                 # add module in mods
                 all_mods.append(mod)
@@ -221,17 +674,21 @@ class AI:
                     if func_name in all_funcs:
                         print(f"[Warning] 函数 '{func_name}' 在多个MCP文件中存在，将使用最后加载的版本")
                     all_funcs[func_name] = func
+        
+        if self.desc_cache:
+            self.desc_cache.save()
         return all_mods, all_funcs
     
     
     # load mcp_tools with self.mcp_paths
     def load_mcp_tools(self):
         # auto load tools: ocr, mcp_config.json
-        # actualy forced temporarily
-        if(self.mcp_paths.count('./tools/ocr.py') == 0):
-            self.mcp_paths.append('./tools/ocr.py')
-        if(self.mcp_paths.count('./tools/mcp_config.json') == 0):
-            self.mcp_paths.append('./tools/mcp_config.json')
+        # actualy forced temporarily, unless default_tools is off
+        if self.default_tools:
+            if(self.mcp_paths.count('./tools/ocr.py') == 0):
+                self.mcp_paths.append('./tools/ocr.py')
+            if(self.mcp_paths.count('./tools/mcp_config.json') == 0):
+                self.mcp_paths.append('./tools/mcp_config.json')
         
         if not self.mcp_paths:
             print("[Error] 未输入任何文件路径")
@@ -246,38 +703,105 @@ class AI:
         print(f"[Info] 将加载 {len(valid_paths)} 个MCP文件")
         
         # load valid MCP files through 'load_mult_mcp_mod'
-        _, self.funcs = self.load_mult_mcp_mod(valid_paths)
-       
-       # add tools description and usage manual to system_prompt
-        if self.funcs:
-            tools_desc = self.gen_tools_desc()
-            self.system_prompt = tools_desc + '\n' + self.system_prompt
+        self.start_loading()
+        try:
+            _, funcs = self.load_mult_mcp_mod(valid_paths)
+            
+            # built-in tool for paging through results cut by result_shaper
+            funcs['read_result'] = self.result_shaper.read
+            with self.funcs_lock:
+                self.funcs = funcs
+                self.refresh_tools()
+        finally:
+            self.finish_loading()
+        
+        # tools description and usage manual are added to system_prompt per turn, see compose_system_prompt
+    
+    
+    # rebuild what is derived from self.funcs: schemas and the relevance index
+    def refresh_tools(self):
+        self.tool_schemas = tools_schema(self.funcs)
+        self.tool_index = ToolIndex({name: f"{name} {func.__doc__ or ''}" for name, func in self.funcs.items()})
             
     
     # add addition mcp_files to the ai agent
     def add_mcp_mods(self, valid_paths):
-        _, funcs = self.load_mult_mcp_mod(valid_paths)
-        self.funcs.update(funcs)
+        self.start_loading()
+        try:
+            _, funcs = self.load_mult_mcp_mod(valid_paths)
+            with self.funcs_lock:
+                self.funcs = {**self.funcs, **funcs}
+                self.refresh_tools()
+        finally:
+            self.finish_loading()
         # print(self.funcs)
-        if self.funcs:
-            tools_desc = "你可以用一下工具来操作文件：\n"
-            for func_name, func in funcs.items():
-                doc = func.__doc__ or "无描述"
-                tools_desc += f"- {func_name}: {doc}\n"
-            self.system_prompt = tools_desc + '\n' + self.system_prompt   
         self.update_system_prompt(self.system_prompt)     
 
     
+    # names of the tools relevant to query, all tools when selection is off
+    # read_result is always kept, results cut earlier may need paging
+    def select_tools(self, query):
+        if not self.tool_top_k or not self.tool_index:
+            return list(self.funcs)
+        names = self.tool_index.search(query, self.tool_top_k)
+        if 'read_result' in self.funcs and 'read_result' not in names:
+            names.append('read_result')
+        return names
+    
+    
+    # text the tools are selected by: the latest two inputs of the user in conv
+    def tool_query(self, conv):
+        inputs = [m["content"] for m in conv if m.get("role") == "user" and not self.context.is_tool_result(m)]
+        return "\n".join(inputs[-2:])
+    
+    
    # generate tools description
-    def gen_tools_desc(self):
+   # query: with tool_top_k, only the tools relevant to it are described in full, after a catalog of all tools
+   # shown: tools described earlier in the conversation, they stay in their order and new ones are appended,
+   #        so the description only grows and the prompt prefix cached by the api stays valid
+    def gen_tools_desc(self, query=None, shown=()):
         if not self.funcs:
             return ""
+        names = list(self.funcs) if query is None else self.select_tools(query)
+        names = [name for name in shown if name in self.funcs] + [name for name in names if name not in shown]
         desc = "你可以用一下工具来操作文件：\n"
-        for func_name, func in self.funcs.items():
-            doc = func.__doc__ or "无描述"
-            desc += f"- {func_name}: {doc}\n"
+        if self.tool_desc != "full":
+            desc += "（格式：工具名(参数: 类型 = 默认值)：说明｜参数说明；参数按此顺序传入，mcp_ 工具用 参数名=值）\n"
+        if query is not None and self.tool_top_k and self.tool_index:
+            desc += f"全部可用工具：{', '.join(self.funcs)}\n以下是部分工具的说明，其他工具需要时也可调用：\n"
+        for func_name in names:
+            desc += f"- {self.describe_tool(func_name)}\n"
         return desc
     
+    
+    # tools described in the system message of conv, in their order there
+    def shown_tools(self, conv):
+        system = next((m["content"] for m in conv if m.get("role") == "system"), "")
+        found = [(system.find(f"- {self.describe_tool(name)}\n"), name) for name in self.funcs] if system else []
+        return [name for pos, name in sorted(found) if pos >= 0]
+    
+    
+    # description of one tool in the tool_desc format
+    # built once per function object, so a tool replaced in self.funcs is described again
+    def describe_tool(self, func_name):
+        func = self.funcs[func_name]
+        cached = self.tool_descs.get(func_name)
+        if cached is None or cached[0] is not func:
+            describe = full_desc if self.tool_desc == "full" else compact_desc
+            cached = self.tool_descs[func_name] = (func, describe(func_name, func))
+        return cached[1]
+    
+    
+    # system message of conv: system_prompt (and the plan syntax in plan mode), then the tools relevant to it
+    # the fixed part comes first and the tool section only grows, see gen_tools_desc
+    # native mode describes tools by schemas instead
+    def compose_system_prompt(self, conv=None):
+        if not self.funcs or self.tool_mode == "native":
+            return self.system_prompt
+        query = self.tool_query(conv) if conv is not None else None
+        prompt = self.system_prompt + PLAN_PROMPT if self.plan_mode else self.system_prompt
+        return prompt + '\n' + self.gen_tools_desc(query, self.shown_tools(conv) if conv else ())
+    
     # initialize ai client, set up self.client
     # find API key in env variables 'DEEPSEEK_API_KEY'
     def init_ai_client(self):
@@ -286,27 +810,199 @@ class AI:
             if not self.api_key:
                 raise ValueError("未提供 API KEY")
         
-        self.client = OpenAI(
-            api_key=self.api_key,
-            base_url='https://api.deepseek.com'
-        )
+        self.client = self.client_pool.client(self.api_key, self.base_url)
         print("[Info] 获取 API KEY 成功")
 
 
+    # (model, temperature) of a route
+    def route_params(self, route):
+        params = self.routes.get(route) or {}
+        return params.get("model") or self.model, params.get("temperature", self.temperature)
+
+
+    # route of the next step from the previous reply of the turn:
+    # "tool" right after a tool step, "final" for the first step
+    def pick_route(self, prev_msg=None):
+        return "tool" if prev_msg is not None and self.is_tool_step(prev_msg) else "final"
+
+
+    # whether an answer from route has to be asked again from the "final" route
+    def needs_reroute(self, route):
+        return route == "tool" and self.reroute_final and self.route_params("tool") != self.route_params("final")
+
+
+    # args of chat.completions.create shared by all requests
+    # conv: the messages sent, self.conv_his by default
+    def request_args(self, conv=None, route="final"):
+        model, temperature = self.route_params(route)
+        args = {
+            "model": model,
+            "temperature": temperature,
+            "messages": self.conv_his if conv is None else conv,
+        }
+        # every schema is sent: native mode has no catalog to fall back on for tools left out
+        if self.tool_mode == "native" and self.tool_schemas:
+            args["tools"] = self.tool_schemas
+        return args
+
+
+    # chat.completions.create, retried by self.retry
+    # every try waits for its slot of self.rate_limiter first
+    def create_completion(self, **kwargs):
+        def create():
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            return self.client.chat.completions.create(**kwargs)
+        return self.retry.call(create)
+
+
+    # stream one reply of a conversation
+    # generator, yields token deltas (str) as soon as they arrive
+    # tool_calls: optional list, filled with the tool calls of the reply (native mode)
+    # record: optional dict, filled with the token counts of the reply
+    # cancel: optional CancelToken, closes the http stream when cancelled
+    def stream_reply(self, tool_calls=None, conv=None, record=None, route="final", cancel=None):
+        response = self.create_completion(**self.request_args(conv, route), stream=True,
+                                          stream_options={"include_usage": True})
+        remove = cancel.on_cancel(response.close) if cancel else (lambda: None)
+        # closing the generator early closes the http stream too
+        try:
+            for chunk in response:
+                # usage comes with the last chunk, which has no choices
+                if chunk.usage and record is not None:
+                    record.update(usage_record(chunk.usage))
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if tool_calls is not None:
+                    merge_tool_calls(tool_calls, delta.tool_calls)
+                if delta.content:
+                    yield delta.content
+        finally:
+            remove()
+            response.close()
+
+
+    # cached reply of a conversation: (key, message)
+    # key is None without a response_cache, message is None on a miss
+    def cached_reply(self, conv=None, route="final"):
+        if self.response_cache is None:
+            return None, None
+        key = self.response_cache.make_key(self.request_args(conv, route))
+        return key, self.response_cache.get(key)
+
+
+    # a cached reply, passed through ReplyGate when streaming as if it came from the api
+    def replay_reply(self, msg, on_delta=None, started=None):
+        if on_delta is None:
+            return msg
+        gate = ReplyGate(on_delta, self.early_dispatcher(started))
+        gate.feed(msg.get("content") or "")
+        return gate.message(msg.get("tool_calls"))
+
+
+    # on_exec_line callback of ReplyGate starting the tool of each YLDEXECUTE line at once
+    # the jobs go to started, later handed to dispatch_tools; None if started is None
+    def early_dispatcher(self, started):
+        if started is None or self.tool_mode == "native":
+            return None
+        def dispatch(line):
+            func_name, args = self.parse_exec_line(line)
+            started.append(self.submit_tool(func_name, *args))
+        return dispatch
+
+
+    # request one reply of a conversation
+    # returns the assistant message: {"role", "content", "tool_calls" (only if the reply has tool calls)}
+    # on_delta: None for a blocking request, or a callback receiving token deltas, see ReplyGate
+    # record: optional dict, filled with the token counts and the wall time of the request
+    # route: "tool" or "final", see routes
+    # started: optional list, filled with the jobs of YLDEXECUTE lines started while streaming
+    # cancel: optional CancelToken, raises Cancelled with the answer streamed so far
+    #         a blocking request is abandoned in its thread, a stream is closed
+    def request_reply(self, on_delta=None, conv=None, record=None, route="final", started=None, cancel=None):
+        start = time.time()
+        key, msg = self.cached_reply(conv, route)
+        hit = msg is not None
+        if hit:
+            msg = self.replay_reply(msg, on_delta, started)
+        elif on_delta is None:
+            args = self.request_args(conv, route)
+            if cancel:
+                response = cancel.wait(run_detached(self.create_completion, **args, stream=False))
+            else:
+                response = self.create_completion(**args, stream=False)
+            msg = reply_message(response.choices[0].message)
+            if record is not None:
+                record.update(usage_record(response.usage))
+        else:
+            gate = ReplyGate(on_delta, self.early_dispatcher(started))
+            tool_calls = []
+            stream = self.stream_reply(tool_calls, conv, record, route, cancel)
+            try:
+                for delta in stream:
+                    if not gate.feed(delta):
+                        stream.close()
+                        break
+            except Exception:
+                # a stream closed by cancel ends with an error of the http client
+                if cancel and cancel.cancelled:
+                    raise Cancelled(gate.reply if gate.forwarding else "") from None
+                raise
+            if cancel:
+                cancel.check(gate.reply if gate.forwarding else "")
+            msg = gate.message(tool_calls)
+        
+        if key and not hit:
+            self.response_cache.put(key, msg)
+        if record is not None:
+            record["cached"] = hit
+            record["api_time"] = time.time() - start
+        return msg
+
+
+    # request_reply on the route picked from the previous reply of the turn
+    # when rerouting, the "tool" route is streamed to no one: its answers never reach the user,
+    # but its YLDEXECUTE lines still start early
+    def routed_reply(self, on_delta=None, conv=None, record=None, prev_msg=None, started=None, cancel=None):
+        route = self.pick_route(prev_msg)
+        reroute = self.needs_reroute(route)
+        record["route"] = route
+        first_delta = (lambda delta: None) if reroute and on_delta else on_delta
+        reply_msg = self.request_reply(first_delta, conv, record, route, started, cancel)
+        if reroute and not self.is_tool_step(reply_msg):
+            self.keep_reroute(record)
+            reply_msg = self.request_reply(on_delta, conv, record, "final", started, cancel)
+        return reply_msg
+
+
+    # move the numbers of a discarded "tool" route request to record["reroute"]
+    def keep_reroute(self, record):
+        keys = ("api_time", "prompt_tokens", "completion_tokens", "cache_hit_tokens", "cached")
+        record["reroute"] = {k: record.pop(k) for k in keys if k in record}
+        record["route"] = "final"
+
+
+    # a new conversation, holding only the system prompt
+    def new_conversation(self):
+        conv = []
+        self.set_system_message(conv)
+        return conv
+
+
     # clear conversation history
     def reset_conversation(self):
-        self.conv_his = [{"role": "system", "content": self.system_prompt}]
+        self.conv_his = self.new_conversation()
         
 
     # execute functions called by ai agents
-    # accept args: [function name, *args]
-    def exec_func(self, func_name, *args):
+    # accept args: [function name, *args], kwargs come from native tool calls
+    def exec_func(self, func_name, *args, **kwargs):
         if func_name not in self.funcs:
             return f"错误：函数 '{func_name}' 不存在"
         try:
             # exec function with args
             if func_name.startswith('mcp_'):
-                kwargs = {}
                 for arg in args:
                     if '=' in arg:
                         key, value = arg.split('=', 1)
@@ -317,66 +1013,305 @@ class AI:
                 # 
                 res = self.funcs[func_name](**kwargs)
             else:
-                res = self.funcs[func_name](*args)
+                res = self.funcs[func_name](*args, **kwargs)
             
             return f"执行成功：{res}"
         except Exception as e:
             return f"执行失败：{e}"
+
+
+    # exec_func, answered from tool_cache for cacheable tools
+    def call_tool(self, func_name, *args, **kwargs):
+        policy = None
+        if self.tool_cache and func_name in self.funcs:
+            policy = self.tool_cache.policy(func_name, self.funcs[func_name])
+        
+        if policy:
+            key = self.tool_cache.make_key(func_name, policy, args, kwargs)
+            res = self.tool_cache.get(key)
+            if res is not None:
+                print(f"[Info] 工具缓存命中：{func_name}")
+            else:
+                print(f"[Info] 工具缓存未命中：{func_name}")
+                res = self.exec_func(func_name, *args, **kwargs)
+                # failures are not cached, they may pass on the next try
+                if res.startswith("执行成功："):
+                    self.tool_cache.put(key, res, policy["ttl"])
+        else:
+            res = self.exec_func(func_name, *args, **kwargs)
+        return res
+
+
+    # call_tool with the result shaped for conv_his
+    def run_tool(self, func_name, *args, **kwargs):
+        res = self.call_tool(func_name, *args, **kwargs)
+        # pages of read_result are already cut to size
+        if func_name == 'read_result':
+            return res
+        return self.result_shaper.shape(func_name, res)
+
+
+    # start a tool on the tool pool, returns a future of the run_tool result
+    def submit_tool(self, func_name, *args, **kwargs):
+        timeout = self.tool_timeouts.get(func_name, self.tool_timeout)
+        return self.submit_job(func_name, timeout, self.run_tool, func_name, *args, **kwargs)
+
+
+    # run func on the tool pool as a job named func_name, allowed timeout seconds
+    # future.stats: {"name", "time"}, time is set once the job finishes
+    def submit_job(self, func_name, timeout, func, *args, **kwargs):
+        stats = {"name": func_name, "time": None}
+        def timed_run():
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stats["time"] = time.time() - start
+        
+        future = self.tool_pool.submit(timed_run)
+        future.func_name = func_name
+        future.timeout = timeout
+        future.submitted = time.time()
+        future.stats = stats
+        return future
+
+
+    # run the steps of a plan (see plan_utils.parse_plan) one after another in this thread
+    # ${N} in args get the full result of step N; the plan stops at the first failed step
+    # returns the results of all steps in one text
+    # deadline: time.time() after which no further step is started, the plan has been reported as timed out
+    # cancel: optional CancelToken, no further step is started once it is cancelled
+    def run_plan(self, plan, deadline=None, cancel=None):
+        results = []
+        lines = []
+        for i, step in enumerate(plan, 1):
+            if cancel and cancel.cancelled:
+                stopped = "已被用户取消"
+            elif deadline and time.time() > deadline:
+                stopped = "计划超时"
+            else:
+                stopped = None
+            if stopped:
+                print(f"[Warning] {stopped}，计划第 {i}/{len(plan)} 步起不再执行")
+                lines += [f"[{j}] {s['tool']}：未执行（{stopped}）" for j, s in enumerate(plan[i - 1:], i)]
+                break
+            func_name = step["tool"]
+            args = resolve_refs(step["args"], results)
+            print(f"[Info] 执行计划第 {i}/{len(plan)} 步：{func_name}")
+            if isinstance(args, dict):
+                res = self.call_tool(func_name, **args)
+            else:
+                res = self.call_tool(func_name, *args)
+            
+            lines.append(f"[{i}] {func_name}：{self.result_shaper.shape(func_name, res)}")
+            if not res.startswith("执行成功："):
+                lines += [f"[{j}] {s['tool']}：未执行（第 {i} 步失败，计划已停止）" for j, s in enumerate(plan[i:], i + 1)]
+                break
+            results.append(res[len("执行成功："):])
+        return "\n" + "\n".join(lines)
+
+
+    # wait for the jobs of dispatch_tools, returns their results in order
+    # every tool gets its own timeout, counted from its submission
+    # a timed out tool is left running in its thread, its result is dropped;
+    # one still queued behind busy tools is cancelled, so it never runs late
+    # cancel: optional CancelToken, tools not done when it is cancelled get a cancelled result
+    def collect_tools(self, jobs, cancel=None):
+        results = []
+        for job in jobs:
+            if isinstance(job, str):
+                results.append(job)
+                continue
+            timeout = job.timeout
+            try:
+                remain = max(0, job.submitted + timeout - time.time())
+                results.append(cancel.wait(job, remain) if cancel else job.result(timeout=remain))
+            except FutureTimeout:
+                job.cancel()
+                results.append(f"执行失败：{job.func_name} 超过 {timeout} 秒未完成")
+            except Cancelled:
+                job.cancel()
+                results.append(f"执行失败：{job.func_name} 已被用户取消")
+        return results
+
+
+    # split one YLDEXECUTE line into (function name, args)
+    def parse_exec_line(self, line):
+        tokens = line.strip()[len(EXEC_PREFIX):].strip().split("￥|")
+        tokens = [t.strip() for t in tokens]
+        return tokens[0], tokens[1:]
+
+
+    # record of one step of the agent loop, completed by request_reply and finish_step
+    def new_step(self, turn, step, conv):
+        return {"turn": turn, "step": step + 1, "messages": len(conv), "time": time.time()}
+    
+    
+    # complete the record of a step with its tools and keep it in self.metrics
+    # jobs: the jobs of dispatch_tools, None if the reply was the final answer
+    def finish_step(self, record, jobs=None):
+        record["type"] = "final" if jobs is None else "tool"
+        record["tools"] = [dict(job.stats) for job in jobs or [] if not isinstance(job, str)]
+        self.metrics.append(record)
+    
+    
+    # records of every step, or of one turn
+    # {"turn", "step", "type", "messages", "time", "api_time", "prompt_tokens",
+    #  "completion_tokens", "cache_hit_tokens", "tools": [{"name", "time"}]}
+    def get_metrics(self, turn=None):
+        return [dict(r) for r in self.metrics if turn is None or r["turn"] == turn]
+
+
+    # calls, api time and tokens of every route over all steps, see routes
+    # discarded "tool" route requests (see reroute_final) count for the "tool" route
+    def get_route_stats(self):
+        stats = {}
+        def add(route, r):
+            s = stats.setdefault(route, {"calls": 0, "api_time": 0.0, "prompt_tokens": 0, "completion_tokens": 0})
+            s["calls"] += 1
+            s["api_time"] += r.get("api_time", 0)
+            s["prompt_tokens"] += r.get("prompt_tokens", 0)
+            s["completion_tokens"] += r.get("completion_tokens", 0)
+        for r in self.metrics:
+            if "reroute" in r:
+                add("tool", r["reroute"])
+            add(r.get("route", "final"), r)
+        for s in stats.values():
+            s["avg_api_time"] = s["api_time"] / s["calls"]
+        return stats
+
+
+    # judge if ai wanna execute some functions
+    def is_tool_step(self, reply_msg):
+        return bool(reply_msg.get("tool_calls")) or reply_msg["content"].startswith(TOOL_PREFIXES)
+
+
+    # start every tool asked in a reply on the tool pool, they run together
+    # returns one job per call: a future of submit_tool, or an error message: str
+    # started: jobs already started while the reply was streaming, see early_dispatcher
+    # cancel: optional CancelToken, handed to a plan so it stops between steps
+    def dispatch_tools(self, reply_msg, step, started=None, cancel=None):
+        jobs = []
+        
+        # native mode: tool calls with json args
+        if reply_msg.get("tool_calls"):
+            for call in reply_msg["tool_calls"]:
+                func_name = call["function"]["name"]
+                print(f"\n[步骤 {step + 1} ][AI 请求执行] {func_name} {call['function']['arguments']}")
+                try:
+                    kwargs = json.loads(call["function"]["arguments"] or "{}")
+                    jobs.append(self.submit_tool(func_name, **kwargs))
+                except json.JSONDecodeError:
+                    jobs.append("错误！参数不是合法的JSON")
+            return jobs
+        
+        # text mode: every YLDEXECUTE line is one tool call
+        # deposit ai's output into [function_name, args]
+        print(f"\n[步骤 {step + 1} ][AI 请求执行] {reply_msg['content']}")
+        if started:
+            return started
+        
+        # a YLDPLAN runs as one job, its steps may depend on each other
+        if reply_msg["content"].startswith(PLAN_PREFIX):
+            try:
+                plan = parse_plan(reply_msg["content"])
+            except ValueError as e:
+                return [f"错误！{e}"]
+            timeout = sum(self.tool_timeouts.get(s["tool"], self.tool_timeout) for s in plan)
+            return [self.submit_job("plan", timeout, self.run_plan, plan, time.time() + timeout, cancel)]
+        
+        lines = [l for l in reply_msg["content"].splitlines() if l.strip().startswith(EXEC_PREFIX)]
+        for func_name, args in map(self.parse_exec_line, lines):
+            jobs.append(self.submit_tool(func_name, *args))
+        return jobs
+
+
+    # append a tool step of ai and the results of its tools to conv
+    # all results go back in one follow-up: "tool" messages in native mode, one user message in text mode
+    def record_tool_step(self, conv, reply_msg, jobs, results):
+        conv.append(reply_msg)
+        
+        if reply_msg.get("tool_calls"):
+            for call, res in zip(reply_msg["tool_calls"], results):
+                print(f"[Info] AI 执行结果：{res}")
+                conv.append({"role": "tool", "tool_call_id": call["id"], "content": res})
+            return
+        
+        if len(results) == 1:
+            res = results[0]
+        else:
+            res = "\n" + "\n".join(f"[{i}] {job.func_name}：{r}" for i, (job, r) in enumerate(zip(jobs, results), 1))
+        print(f"[Info] AI 执行结果：{res}")
+        conv.append({"role": "user", "content": f"{RESULT_PREFIX}{res}\n请根据这个结果决定下一步操作。如果任务完成，请总结告诉我结果。"})
+        
+        # if "错误" in res or "失败" in res:
+        #     print("[Warning] 执行失败，建议手动检查")
+        #     final_resp = f"上一步执行失败：{res}"
+        #     break
       
         
+    # end a cancelled turn, keeping what was done so far
+    # record: the step cut short, None between steps; partial: answer streamed before the cancellation
+    def stop_turn(self, conv, record, partial=""):
+        print("[Info] 已停止当前任务")
+        if record is not None:
+            record["cancelled"] = True
+            self.finish_step(record)
+        if partial:
+            conv.append({"role": "assistant", "content": partial})
+            return partial + "\n（已停止）", False
+        return "已停止", False
+
+
     # process uer input
     # args: user_input: str, max exec iters (15 by default): int
-    def process_user_inp(self, user_inp, max_iter = 15):
+    # on_delta: optional callback for streaming, receives token deltas of the final reply
+    # conv_his: the conversation to continue, self.conv_his by default
+    # cancel: optional CancelToken stopping the turn, see stop_turn
+    # returns (reply, completed): completed is False when max_iter ran out, the request failed or was cancelled
+    def process_user_inp(self, user_inp, max_iter = 15, on_delta=None, conv_his=None, cancel=None):
         if not user_inp:
             return "", False
+        conv = self.conv_his if conv_his is None else conv_his
 
         # add conv_his with user's input
-        self.conv_his.append({"role": "user", "content": user_inp})
+        # the system message describes the tools relevant to it
+        conv.append({"role": "user", "content": user_inp})
+        self.set_system_message(conv)
+        self.last_turn = turn = next(self.turn_ids)
+        reply_msg = None
         
         for step in range(max_iter):
+            record = None
+            started = []
             try:
-                response = self.client.chat.completions.create(  
-                    model="deepseek-chat",
-                    temperature=self.temperature,
-                    # feed ai with the whole conversation history
-                    messages=self.conv_his,  
-                    stream=False
-                )  
-                get_reply = response.choices[0].message.content
+                if cancel:
+                    cancel.check()
+                # feed ai with the conversation history, fitted to the token budget
+                # the reply is complete here even when streaming
+                conv[:] = self.context.fit(conv)
+                record = self.new_step(turn, step, conv)
+                reply_msg = self.routed_reply(on_delta, conv, record, reply_msg, started, cancel)
                 
-                # judge if ai wanna execute some functions
-                if get_reply.startswith("YLDEXECUTE:"):
-                    print(f"\n[步骤 {step + 1} ][AI 请求执行] {get_reply}")
-                    
-                    tokens = get_reply.replace("YLDEXECUTE:", "").strip().split("￥|")
-                    tokens = [t.strip() for t in tokens]
-                    
-                    # deposit ai's output into [function_name, args]
-                    if len(tokens) < 1:
-                        res = "错误！你的命令格式不正确"
-                    else:
-                        func_name = tokens[0]
-                        args = tokens[1: ] if len(tokens) > 1 else []
-                        res = self.exec_func(func_name, *args)
-                        
-                    print(f"[Info] AI 执行结果：{res}")
-                    
-                    self.conv_his.append({"role": "assistant", "content": get_reply})
-                    self.conv_his.append({"role": "user", "content": f"执行结果：{res}\n请根据这个结果决定下一步操作。如果任务完成，请总结告诉我结果。"})
-                    
-                    # if "错误" in res or "失败" in res:
-                    #     print("[Warning] 执行失败，建议手动检查")
-                    #     final_resp = f"上一步执行失败：{res}"
-                    #     break
+                if self.is_tool_step(reply_msg):
+                    jobs = self.dispatch_tools(reply_msg, step, started, cancel)
+                    self.record_tool_step(conv, reply_msg, jobs, self.collect_tools(jobs, cancel))
+                    self.finish_step(record, jobs)
                 else:
-                    
                     # no execution: break the circulation
-                    self.conv_his.append({"role": "assistant", "content": get_reply}) 
-                    return get_reply, True
+                    self.finish_step(record)
+                    conv.append(reply_msg) 
+                    return reply_msg["content"], True
+            except Cancelled as e:
+                for job in started:
+                    job.cancel()
+                return self.stop_turn(conv, record, e.partial)
             except Exception as e:
-                return f"处理过程中发生错误：{e}", True
+                if cancel and cancel.cancelled:
+                    return self.stop_turn(conv, record)
+                return f"处理过程中发生错误：{e}", False
         
-        return f"已达到最大执行步数({max_iter})，任务可能未完全完成"
+        return f"已达到最大执行步数({max_iter})，任务可能未完全完成", False
 
     # get tools: list[str] {"name": function name, "description": .__doc__}
     def get_available_tools(self):
@@ -386,6 +1321,12 @@ class AI:
             tools.append({"name": func_name, "description": doc})
         return tools
     
+    # print where the time of startup went, slowest stages first
+    def print_startup_report(self):
+        print("\n[Info] 启动耗时：")
+        for label, secs in sorted(self.startup_times, key=lambda t: -t[1]):
+            print(f"  {secs:7.3f}s  {label}")
+    
     def print_tools_list(self):
         print("\n可用工具：")
         tools = self.get_available_tools()
@@ -394,24 +1335,272 @@ class AI:
         
     
     # update prompts
+    # replaces the system message in place, conv_his keeps exactly one
     def update_system_prompt(self, new_prompt):
         self.system_prompt = new_prompt
-        self.conv_his.append({"role": "system", "content": self.system_prompt})
+        self.set_system_message(self.conv_his)
+    
+    # make the current system prompt the only system message of conv
+    def set_system_message(self, conv):
+        # composed from the old system message, which tells the tools described so far
+        content = self.compose_system_prompt(conv)
+        conv[:] = [m for m in conv if m.get("role") != "system"]
+        conv.insert(0, {"role": "system", "content": content})
     
     # update temperature
     def update_temperature(self, new_temp):
         self.temperature= new_temp
 
 
+# an asyncio event loop running forever in a daemon thread
+# coroutines are submitted from other threads (e.g. the Qt GUI thread) and give concurrent futures
+class AsyncLoop:
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="async-ai", daemon=True)
+        self.thread.start()
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+
+_shared_loop = None
+_shared_loop_lock = threading.Lock()
+
+# the AsyncLoop shared by all AsyncAI instances
+def shared_loop():
+    global _shared_loop
+    with _shared_loop_lock:
+        if _shared_loop is None:
+            _shared_loop = AsyncLoop()
+        return _shared_loop
+
+
+# asyncio counterpart of AI, built on the async openai client
+# many conversations (see conv_his) and their tools can be in flight at once on one event loop,
+# without an OS thread per request; tools still run on AI.tool_pool
+class AsyncAI(AI):
+    def __init__(self, *args, loop=None, **kwargs):
+        # loop: AsyncLoop running the coroutines, shared_loop() by default
+        self.loop = loop or shared_loop()
+        self.aclient = None
+        super().__init__(*args, **kwargs)
+
+    # set up the async client beside the blocking one
+    def init_ai_client(self):
+        super().init_ai_client()
+        self.aclient = self.client_pool.aclient(self.api_key, self.base_url, self.loop)
+
+    # async version of AI.create_completion
+    async def acreate_completion(self, **kwargs):
+        async def create():
+            if self.rate_limiter:
+                await self.rate_limiter.aacquire()
+            return await self.aclient.chat.completions.create(**kwargs)
+        return await self.retry.acall(create)
+
+    # schedule a coroutine on the event loop from any thread, returns a concurrent future
+    def submit(self, coro):
+        return self.loop.submit(coro)
+
+    # cancel the running task (on this loop) while the block runs and token is cancelled
+    # the task sees asyncio.CancelledError at the await it is waiting in
+    @contextlib.contextmanager
+    def cancelling(self, cancel):
+        if cancel is None:
+            yield
+            return
+        task = asyncio.current_task()
+        loop = asyncio.get_running_loop()
+        remove = cancel.on_cancel(lambda: loop.call_soon_threadsafe(task.cancel))
+        try:
+            yield
+        finally:
+            remove()
+
+    # async version of AI.stream_reply
+    async def astream_reply(self, tool_calls=None, conv=None, record=None, route="final"):
+        response = await self.acreate_completion(**self.request_args(conv, route), stream=True,
+                                                 stream_options={"include_usage": True})
+        try:
+            async for chunk in response:
+                if chunk.usage and record is not None:
+                    record.update(usage_record(chunk.usage))
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if tool_calls is not None:
+                    merge_tool_calls(tool_calls, delta.tool_calls)
+                if delta.content:
+                    yield delta.content
+        finally:
+            await response.close()
+
+    # async version of AI.request_reply
+    async def arequest_reply(self, on_delta=None, conv=None, record=None, route="final", started=None, cancel=None):
+        start = time.time()
+        key, msg = self.cached_reply(conv, route)
+        hit = msg is not None
+        if hit:
+            msg = self.replay_reply(msg, on_delta, started)
+        elif on_delta is None:
+            with self.cancelling(cancel):
+                response = await self.acreate_completion(**self.request_args(conv, route), stream=False)
+            msg = reply_message(response.choices[0].message)
+            if record is not None:
+                record.update(usage_record(response.usage))
+        else:
+            gate = ReplyGate(on_delta, self.early_dispatcher(started))
+            tool_calls = []
+            stream = self.astream_reply(tool_calls, conv, record, route)
+            try:
+                with self.cancelling(cancel):
+                    async for delta in stream:
+                        if not gate.feed(delta):
+                            await stream.aclose()
+                            break
+            except asyncio.CancelledError:
+                raise Cancelled(gate.reply if gate.forwarding else "") from None
+            msg = gate.message(tool_calls)
+        
+        if key and not hit:
+            self.response_cache.put(key, msg)
+        if record is not None:
+            record["cached"] = hit
+            record["api_time"] = time.time() - start
+        return msg
+
+    # async version of AI.routed_reply
+    async def arouted_reply(self, on_delta=None, conv=None, record=None, prev_msg=None, started=None, cancel=None):
+        route = self.pick_route(prev_msg)
+        reroute = self.needs_reroute(route)
+        record["route"] = route
+        first_delta = (lambda delta: None) if reroute and on_delta else on_delta
+        reply_msg = await self.arequest_reply(first_delta, conv, record, route, started, cancel)
+        if reroute and not self.is_tool_step(reply_msg):
+            self.keep_reroute(record)
+            reply_msg = await self.arequest_reply(on_delta, conv, record, "final", started, cancel)
+        return reply_msg
+
+    # async version of AI.collect_tools, the tools are awaited together
+    async def acollect_tools(self, jobs, cancel=None):
+        async def wait(job):
+            if isinstance(job, str):
+                return job
+            timeout = job.timeout
+            try:
+                remain = max(0, job.submitted + timeout - time.time())
+                return await asyncio.wait_for(asyncio.wrap_future(job), remain)
+            except asyncio.TimeoutError:
+                return f"执行失败：{job.func_name} 超过 {timeout} 秒未完成"
+            except asyncio.CancelledError:
+                job.cancel()
+                return f"执行失败：{job.func_name} 已被用户取消"
+        
+        tasks = [asyncio.ensure_future(wait(job)) for job in jobs]
+        try:
+            with self.cancelling(cancel):
+                return list(await asyncio.gather(*tasks))
+        except asyncio.CancelledError:
+            # every wait has ended by now, with its result or a cancelled one
+            return [t.result() if not t.cancelled() else "执行失败：已被用户取消" for t in tasks]
+
+    # async version of AI.process_user_inp
+    async def aprocess_user_inp(self, user_inp, max_iter = 15, on_delta=None, conv_his=None, cancel=None):
+        if not user_inp:
+            return "", False
+        conv = self.conv_his if conv_his is None else conv_his
+        conv.append({"role": "user", "content": user_inp})
+        self.set_system_message(conv)
+        self.last_turn = turn = next(self.turn_ids)
+        reply_msg = None
+        
+        for step in range(max_iter):
+            record = None
+            started = []
+            try:
+                if cancel:
+                    cancel.check()
+                conv[:] = self.context.fit(conv)
+                record = self.new_step(turn, step, conv)
+                reply_msg = await self.arouted_reply(on_delta, conv, record, reply_msg, started, cancel)
+                
+                if self.is_tool_step(reply_msg):
+                    jobs = self.dispatch_tools(reply_msg, step, started, cancel)
+                    self.record_tool_step(conv, reply_msg, jobs, await self.acollect_tools(jobs, cancel))
+                    self.finish_step(record, jobs)
+                else:
+                    self.finish_step(record)
+                    conv.append(reply_msg) 
+                    return reply_msg["content"], True
+            except (Cancelled, asyncio.CancelledError) as e:
+                for job in started:
+                    job.cancel()
+                return self.stop_turn(conv, record, getattr(e, "partial", ""))
+            except Exception as e:
+                return f"处理过程中发生错误：{e}", False
+        
+        return f"已达到最大执行步数({max_iter})，任务可能未完全完成", False
+
+    # blocking wrapper, runs aprocess_user_inp on the event loop and waits for it
+    def process_user_inp(self, user_inp, max_iter = 15, on_delta=None, conv_his=None, cancel=None):
+        return self.submit(self.aprocess_user_inp(user_inp, max_iter, on_delta, conv_his, cancel)).result()
+
+
 # an instance of console using AI class
 def main():
-    MCP_PATH = input("MCP文件所在的目录(支持.py或.json)(多个文件用空格隔开):").strip()
-    mcp_paths = [p.strip() for p in MCP_PATH.split() if p.strip()]
-    ai = AI(mcp_paths=mcp_paths)
+    parser = argparse.ArgumentParser(description="Deepseek Desktop console")
+    parser.add_argument("--metrics", action="store_true", help="print a summary of steps, tokens and time after every turn")
+    parser.add_argument("--metrics-out", metavar="FILE", help="append the record of every step to a JSONL file")
+    parser.add_argument("--temperature", type=float, default=1.0, help="sampling temperature, 0 for replayable runs")
+    parser.add_argument("--response-cache", metavar="FILE", nargs="?", const=".cache/responses.sqlite",
+                        help="replay replies of identical requests from a sqlite cache (default file: %(const)s)")
+    parser.add_argument("--mcp", nargs="*", metavar="PATH", help="tool files (.py or .json), asked interactively if not given")
+    parser.add_argument("--batch", metavar="FILE", help="run the prompts of a JSONL file instead of the console")
+    parser.add_argument("--out", metavar="FILE", help="results of --batch, <batch file>.out.jsonl by default; reruns resume it")
+    parser.add_argument("--workers", type=int, default=4, help="conversations of --batch run at once")
+    parser.add_argument("--rpm", type=int, help="max api requests per minute")
+    parser.add_argument("--model", default="deepseek-chat", help="model of the first step of every turn")
+    parser.add_argument("--tool-model", help="model of the steps following a tool step, --model by default")
+    parser.add_argument("--tool-temperature", type=float, help="temperature of those steps, --temperature by default")
+    parser.add_argument("--reroute-final", action="store_true",
+                        help="ask answers given on the --tool-model route again from --model")
+    parser.add_argument("--plan", action="store_true", help="let the model send multi-step YLDPLANs run locally at once")
+    parser.add_argument("--tool-processes", type=int, metavar="N", help="run python tools in N worker processes")
+    parser.add_argument("--tool-desc", choices=["compact", "full"], default="compact",
+                        help="describe tools in the prompt by one signature line each, or by their whole docstrings")
+    opts = parser.parse_args()
+    
+    if opts.mcp is not None or opts.batch:
+        mcp_paths = opts.mcp or []
+    else:
+        MCP_PATH = input("MCP文件所在的目录(支持.py或.json)(多个文件用空格隔开):").strip()
+        mcp_paths = [p.strip() for p in MCP_PATH.split() if p.strip()]
+    tool_route = {"model": opts.tool_model}
+    if opts.tool_temperature is not None:
+        tool_route["temperature"] = opts.tool_temperature
+    ai = AI(mcp_paths=mcp_paths, temperature=opts.temperature, response_cache=opts.response_cache,
+            rpm=opts.rpm, tool_workers=max(4, opts.workers), model=opts.model, routes={"tool": tool_route},
+            reroute_final=opts.reroute_final, plan_mode=opts.plan, tool_processes=opts.tool_processes, tool_desc=opts.tool_desc)
+    
+    if opts.batch:
+        out_path = opts.out or os.path.splitext(opts.batch)[0] + ".out.jsonl"
+        run_batch(ai, opts.batch, out_path, workers=opts.workers)
+        return
+    
     while True:
         try:
             user_inp = input("\n>>").strip()
             if user_inp.lower() in ['exit', 'quit', 'bye', '退出', '再见']:
+                if ai.response_cache:
+                    stats = ai.response_cache.stats()
+                    print(f"[Info] 回复缓存：命中 {stats['hits']} 次，未命中 {stats['misses']} 次，"
+                          f"命中率 {stats['hit_rate']:.0%}，共 {stats['items']} 条")
+                if opts.metrics:
+                    for route, stats in ai.get_route_stats().items():
+                        print(f"[统计] 路由 {route}（{ai.route_params(route)[0]}）：{stats['calls']} 次请求，"
+                              f"平均 {stats['avg_api_time']:.2f}s，prompt {stats['prompt_tokens']}，"
+                              f"completion {stats['completion_tokens']} tokens")
                 print("再见！")
                 break
             if not user_inp:
@@ -427,6 +1616,19 @@ def main():
             if response:
                 print(f"\n[AI] {response}")
             
+            records = ai.get_metrics(ai.last_turn)
+            if opts.metrics and records:
+                print(f"[统计] 第 {ai.last_turn} 轮：{summarize_turn(records)}")
+                for r in records:
+                    tools = "，".join(f"{t['name']} {t['time'] or 0:.2f}s" for t in r["tools"])
+                    print(f"  步骤 {r['step']}[{r.get('route')}]：{'回复缓存' if r.get('cached') else 'API'} {r.get('api_time', 0):.2f}s，prompt {r.get('prompt_tokens', 0)}，"
+                          f"缓存命中 {r.get('cache_hit_tokens', 0)}，completion {r.get('completion_tokens', 0)}"
+                          + (f"，工具 {tools}" if tools else ""))
+            if opts.metrics_out and records:
+                with open(opts.metrics_out, 'a', encoding='utf-8') as f:
+                    for r in records:
+                        f.write(json.dumps(r, ensure_ascii=False) + "\n")
+            
         except KeyboardInterrupt:
             print("\n[Error] 中断操作，再见！")
             break
@@ -0,0 +1,91 @@
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+# prompts of a JSONL file: [(id, prompt)]
+# a line is {"id": ..., "prompt": ...} or a bare json string; lines without an id are numbered from 1
+def read_prompts(path):
+    prompts = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                print(f"[Warning] 第 {line_no} 行不是合法的JSON，已跳过")
+                continue
+            if isinstance(item, str):
+                item = {"prompt": item}
+            if not isinstance(item, dict) or not item.get("prompt"):
+                print(f"[Warning] 第 {line_no} 行缺少 prompt，已跳过")
+                continue
+            prompts.append((item.get("id", line_no), item["prompt"]))
+    return prompts
+
+
+# ids of the prompts completed in an earlier run of the same output file
+# prompts that failed or ran out of steps are not counted, so they run again
+def completed_ids(out_path):
+    done = set()
+    if not os.path.exists(out_path):
+        return done
+    with open(out_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                item = json.loads(line)
+            except ValueError:
+                # a line cut off by a crash
+                continue
+            if item.get("completed"):
+                done.add(json.dumps(item.get("id")))
+    return done
+
+
+# runs the prompts of in_path as independent conversations of ai, `workers` at a time
+# every result is appended to out_path as soon as it finishes, a rerun skips the completed ones
+# requests per minute are limited by the ai itself, see AI(rpm=...)
+def run_batch(ai, in_path, out_path, workers=4, max_iter=15):
+    prompts = read_prompts(in_path)
+    done = completed_ids(out_path)
+    todo = [(pid, prompt) for pid, prompt in prompts if json.dumps(pid) not in done]
+    print(f"[Info] 批处理：共 {len(prompts)} 条，已完成 {len(prompts) - len(todo)} 条，待处理 {len(todo)} 条")
+
+    # start on a new line if the last run was cut off in the middle of one
+    if os.path.exists(out_path) and os.path.getsize(out_path):
+        with open(out_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            cut = f.read(1) != b"\n"
+        if cut:
+            with open(out_path, "a", encoding="utf-8") as f:
+                f.write("\n")
+
+    counts = {"completed": 0, "failed": 0}
+    start = time.time()
+
+    def run_one(pid, prompt):
+        conv = ai.new_conversation()
+        t0 = time.time()
+        try:
+            response, completed = ai.process_user_inp(prompt, max_iter=max_iter, conv_his=conv)
+        except Exception as e:
+            response, completed = f"处理过程中发生错误：{e}", False
+        return {"id": pid, "prompt": prompt, "response": response, "completed": completed,
+                "steps": sum(1 for m in conv if m.get("role") == "assistant"), "time": round(time.time() - t0, 3)}
+
+    with open(out_path, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_one, pid, prompt) for pid, prompt in todo]
+        for future in as_completed(futures):
+            result = future.result()
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            counts["completed" if result["completed"] else "failed"] += 1
+            finished = counts["completed"] + counts["failed"]
+            print(f"[Info] 批处理进度：{finished}/{len(todo)}（id={result['id']}，{'完成' if result['completed'] else '失败'}）")
+
+    elapsed = time.time() - start
+    print(f"[Info] 批处理结束：完成 {counts['completed']} 条，失败 {counts['failed']} 条，用时 {elapsed:.1f}s")
+    return dict(counts, skipped=len(prompts) - len(todo), seconds=elapsed)
@@ -0,0 +1,256 @@
+import os
+import json
+import time
+import argparse
+import tempfile
+import threading
+import contextlib
+import tracemalloc
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from aiclass import AI, EXEC_PREFIX, RESULT_PREFIX
+
+
+# offline benchmark of the agent loop (AI.process_user_inp)
+# a local stand-in for the chat completions endpoint answers with scripted YLDEXECUTE steps,
+# so the overhead of the loop itself can be measured without api.deepseek.com
+#
+#   uv run python ./bench_agent.py
+#   uv run python ./bench_agent.py --steps 1 5 15 --turns 5 --concurrency 1 4 16 --latency 0.02
+
+
+# tool module loaded by the benchmark, written to a temp file and passed as a mcp_path
+BENCH_TOOLS = '''
+def bench_echo(index: int, size: int = 200) -> str:
+    """
+    返回指定长度的测试文本
+
+    Args:
+        index: 步骤编号
+        size: 返回文本的字符数
+    """
+    line = f"step {index} result line. "
+    return (line * (int(size) // len(line) + 1))[:int(size)]
+'''
+
+
+# steps wanted by a user message of the benchmark, "bench steps=5 size=200 ..."
+def parse_bench_prompt(text):
+    opts = {"steps": 1, "size": 200}
+    for word in (text or "").split():
+        key, _, value = word.partition("=")
+        if key in opts and value.isdigit():
+            opts[key] = int(value)
+    return opts
+
+
+# scripted reply to a chat completions request
+# stateless: the tool results after the latest user message tell which step this is,
+# so any number of conversations can run against the server at once
+def scripted_reply(messages):
+    done = 0
+    prompt = ""
+    for msg in reversed(messages):
+        content = msg.get("content") or ""
+        if msg.get("role") == "user" and content.startswith(RESULT_PREFIX):
+            done += 1
+        elif msg.get("role") == "user":
+            prompt = content
+            break
+    opts = parse_bench_prompt(prompt)
+    if done < opts["steps"]:
+        return f"{EXEC_PREFIX} bench_echo ￥| {done + 1} ￥| {opts['size']}"
+    return f"已完成 {done} 个步骤。"
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    # seconds the server waits before answering, set by MockServer
+    latency = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        content = scripted_reply(body.get("messages", []))
+        usage = {
+            "prompt_tokens": sum(len(m.get("content") or "") for m in body.get("messages", [])) // 3,
+            "completion_tokens": len(content) // 3,
+            "total_tokens": 0,
+            "prompt_cache_hit_tokens": 0,
+        }
+        time.sleep(self.latency)
+
+        if body.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            for i in range(0, len(content), 8):
+                chunk = {"id": "bench", "object": "chat.completion.chunk", "created": 0, "model": body.get("model"),
+                         "choices": [{"index": 0, "delta": {"content": content[i:i + 8]}, "finish_reason": None}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            chunk = {"id": "bench", "object": "chat.completion.chunk", "created": 0, "model": body.get("model"),
+                     "choices": [], "usage": usage}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+            return
+
+        data = json.dumps({
+            "id": "bench", "object": "chat.completion", "created": 0, "model": body.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage,
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+# the mock endpoint on 127.0.0.1, served from a daemon thread
+class MockServer:
+    def __init__(self, latency=0.0):
+        handler = type("BenchHandler", (MockHandler,), {"latency": latency})
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# AI pointed at the mock server, with only the benchmark tool loaded
+def make_ai(base_url, tools_path, **kwargs):
+    return AI(mcp_paths=[tools_path], api_key="sk-bench", base_url=base_url, default_tools=False,
+              lazy_tools=False, tool_cache=False, **kwargs)
+
+
+# one conversation of `turns` turns with `steps` tool steps each, history grows from turn to turn
+# returns a row per turn: time, overhead per step, size of conv_his
+def run_scenario(ai, steps, turns, size, stream):
+    on_delta = (lambda delta: None) if stream else None
+    conv = ai.new_conversation()
+    rows = []
+    tracemalloc.start()
+    base_mem = tracemalloc.get_traced_memory()[0]
+    for _ in range(turns):
+        start = time.perf_counter()
+        _, completed = ai.process_user_inp(f"bench steps={steps} size={size}", max_iter=steps + 2,
+                                           on_delta=on_delta, conv_his=conv)
+        elapsed = time.perf_counter() - start
+
+        records = ai.get_metrics(ai.last_turn)
+        waited = sum(r.get("api_time", 0) for r in records)
+        waited += sum(t.get("time") or 0 for r in records for t in r.get("tools", []))
+        rows.append({
+            "steps": steps,
+            "completed": completed,
+            "turn_time": elapsed,
+            "overhead_per_step": (elapsed - waited) / max(len(records), 1),
+            "api_per_step": sum(r.get("api_time", 0) for r in records) / max(len(records), 1),
+            "messages": len(conv),
+            "history_chars": len(json.dumps(conv, ensure_ascii=False)),
+            "traced_kb": (tracemalloc.get_traced_memory()[0] - base_mem) / 1024,
+        })
+    tracemalloc.stop()
+    return rows
+
+
+# `concurrency` conversations at once on one AI, returns turns per second
+def run_concurrent(ai, steps, concurrency, turns, size, stream):
+    on_delta = (lambda delta: None) if stream else None
+    errors = []
+
+    def worker():
+        conv = ai.new_conversation()
+        for _ in range(turns):
+            _, completed = ai.process_user_inp(f"bench steps={steps} size={size}", max_iter=steps + 2,
+                                               on_delta=on_delta, conv_his=conv)
+            if not completed:
+                errors.append(1)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return {
+        "steps": steps,
+        "concurrency": concurrency,
+        "turns": concurrency * turns,
+        "seconds": elapsed,
+        "turns_per_sec": concurrency * turns / elapsed,
+        "steps_per_sec": concurrency * turns * (steps + 1) / elapsed,
+        "failed": len(errors),
+    }
+
+
+# silences the [Info] prints of the agent loop while measuring
+@contextlib.contextmanager
+def quiet():
+    with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def main():
+    parser = argparse.ArgumentParser(description="offline benchmark of the agent loop against a mock api")
+    parser.add_argument("--steps", type=int, nargs="+", default=[1, 5, 15], help="tool steps per turn of each scenario")
+    parser.add_argument("--turns", type=int, default=5, help="turns per conversation, history grows across them")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="conversations run at once")
+    parser.add_argument("--size", type=int, default=200, help="chars of every tool result")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the mock api waits before answering")
+    parser.add_argument("--stream", action="store_true", help="stream replies, as the gui does")
+    parser.add_argument("--json", metavar="FILE", help="also write every result row to a JSONL file")
+    opts = parser.parse_args()
+
+    server = MockServer(opts.latency).start()
+    with tempfile.TemporaryDirectory() as tmp:
+        tools_path = os.path.join(tmp, "bench_tools.py")
+        with open(tools_path, "w", encoding="utf-8") as f:
+            f.write(BENCH_TOOLS)
+
+        ai = make_ai(server.base_url, tools_path, tool_workers=max(4, max(opts.concurrency)))
+        results = []
+        try:
+            print("\n== 单会话：每步开销与历史增长 ==")
+            print(f"{'steps':>5} {'turn':>4} {'turn_s':>8} {'api/step_ms':>11} {'overhead/step_ms':>16} "
+                  f"{'msgs':>5} {'hist_chars':>10} {'traced_kb':>9}")
+            for steps in opts.steps:
+                with quiet():
+                    rows = run_scenario(ai, steps, opts.turns, opts.size, opts.stream)
+                for i, row in enumerate(rows, 1):
+                    print(f"{steps:>5} {i:>4} {row['turn_time']:>8.3f} {row['api_per_step'] * 1000:>11.2f} "
+                          f"{row['overhead_per_step'] * 1000:>16.2f} {row['messages']:>5} "
+                          f"{row['history_chars']:>10} {row['traced_kb']:>9.1f}")
+                results += [dict(row, kind="scenario", turn=i) for i, row in enumerate(rows, 1)]
+
+            print("\n== 并发吞吐 ==")
+            print(f"{'steps':>5} {'conc':>4} {'turns':>5} {'seconds':>8} {'turns/s':>8} {'steps/s':>8} {'failed':>6}")
+            for steps in opts.steps:
+                for concurrency in opts.concurrency:
+                    with quiet():
+                        row = run_concurrent(ai, steps, concurrency, opts.turns, opts.size, opts.stream)
+                    print(f"{steps:>5} {concurrency:>4} {row['turns']:>5} {row['seconds']:>8.3f} "
+                          f"{row['turns_per_sec']:>8.2f} {row['steps_per_sec']:>8.2f} {row['failed']:>6}")
+                    results.append(dict(row, kind="concurrency"))
+        finally:
+            server.stop()
+            ai.tool_pool.shutdown(wait=False)
+
+    if opts.json:
+        with open(opts.json, "w", encoding="utf-8") as f:
+            for row in results:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
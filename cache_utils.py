@@ -0,0 +1,175 @@
+import os
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import threading
+import urllib.request
+from collections import OrderedDict
+
+
+# tools known to be deterministic: {function name: {"ttl": seconds, "key": "file" | "url" | None}}
+# "file": results also depend on the files named in the args (mtime and size)
+# "url": results also depend on the pages named in the args (ETag / Last-Modified)
+# a tool can also mark itself with the attributes 'cache_ttl' and 'cache_key'
+DEFAULT_POLICIES = {
+    "ocr_process_pictures": {"ttl": 7 * 24 * 3600, "key": "file"},
+    "read_page": {"ttl": 600, "key": "url"},
+    "get_system_info": {"ttl": 60, "key": None},
+    "format_system_info": {"ttl": 60, "key": None},
+}
+
+
+# memoizes results of deterministic tools, LRU in memory and pickled on disk
+class ToolCache:
+    def __init__(self, cache_dir=".cache/tools", max_items=256):
+        # cache_dir: None to keep results in memory only
+        self.cache_dir = cache_dir
+        self.max_items = max_items
+        self.policies = dict(DEFAULT_POLICIES)
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    # {"ttl", "key"} of a tool, or None if it is not cacheable
+    def policy(self, func_name, func):
+        if getattr(func, "cache_ttl", None):
+            return {"ttl": func.cache_ttl, "key": getattr(func, "cache_key", None)}
+        return self.policies.get(func_name)
+
+    # what the result depends on besides the args
+    def fingerprint(self, kind, values):
+        marks = []
+        for value in values:
+            if not isinstance(value, str):
+                continue
+            if kind == "file" and os.path.isfile(value):
+                stat = os.stat(value)
+                marks.append([value, stat.st_mtime_ns, stat.st_size])
+            elif kind == "url" and value.startswith(("http://", "https://")):
+                marks.append([value, self.url_version(value)])
+        return marks
+
+    # ETag or Last-Modified of a page, "" if the server gives neither
+    def url_version(self, url):
+        try:
+            request = urllib.request.Request(url, method="HEAD")
+            with urllib.request.urlopen(request, timeout=3) as response:
+                return response.headers.get("ETag") or response.headers.get("Last-Modified") or ""
+        except Exception:
+            return ""
+
+    def make_key(self, func_name, policy, args, kwargs):
+        values = list(args) + list(kwargs.values())
+        raw = json.dumps([func_name, list(args), sorted(kwargs.items()),
+                          self.fingerprint(policy.get("key"), values)], ensure_ascii=False, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + ".pkl")
+
+    # cached result of key, or None
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry and entry[0] > now:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+        if self.cache_dir and os.path.exists(self.path(key)):
+            try:
+                with open(self.path(key), "rb") as f:
+                    entry = pickle.load(f)
+                if entry[0] > now:
+                    with self.lock:
+                        self.memory[key] = entry
+                        self.hits += 1
+                    return entry[1]
+                os.remove(self.path(key))
+            except Exception:
+                pass
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, result, ttl):
+        entry = (time.time() + ttl, result)
+        with self.lock:
+            self.memory[key] = entry
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_items:
+                self.memory.popitem(last=False)
+
+        if self.cache_dir:
+            try:
+                tmp = self.path(key) + f".{threading.get_ident()}.tmp"
+                with open(tmp, "wb") as f:
+                    pickle.dump(entry, f)
+                os.replace(tmp, self.path(key))
+            except Exception as e:
+                print(f"[Warning] 写入工具缓存失败：{e}")
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+# replies of the chat api, stored in sqlite and keyed on everything the reply depends on
+# opt-in: only worth it for replayed workflows at temperature 0, where the same request gives the same reply
+class ResponseCache:
+    def __init__(self, path=".cache/responses.sqlite", max_items=2000):
+        # max_items: replies kept, the least recently used ones are evicted
+        self.path = path
+        self.max_items = max_items
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS responses "
+                        "(key TEXT PRIMARY KEY, reply TEXT NOT NULL, used REAL NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_used ON responses (used)")
+        self.db.commit()
+
+    # key of a request: model, temperature, messages (and tools, which shape the reply too)
+    def make_key(self, args):
+        raw = json.dumps([args.get("model"), args.get("temperature"), args.get("messages"), args.get("tools")],
+                         ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    # cached assistant message of key, or None
+    def get(self, key):
+        with self.lock:
+            row = self.db.execute("SELECT reply FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.db.execute("UPDATE responses SET used = ? WHERE key = ?", (time.time(), key))
+            self.db.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, reply):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO responses (key, reply, used) VALUES (?, ?, ?)",
+                            (key, json.dumps(reply, ensure_ascii=False), time.time()))
+            self.db.execute("DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+                            "ORDER BY used DESC LIMIT -1 OFFSET ?)", (self.max_items,))
+            self.db.commit()
+
+    def clear(self):
+        with self.lock:
+            self.db.execute("DELETE FROM responses")
+            self.db.commit()
+
+    def stats(self):
+        with self.lock:
+            items = self.db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0, "items": items}
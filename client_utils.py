@@ -0,0 +1,177 @@
+import time
+import random
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+
+import httpx
+import openai
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+
+
+# statuses worth another try: timeout, conflict, rate limit and server errors
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+# readable reasons of the statuses above, used in RequestFailed
+STATUS_REASONS = {
+    408: "请求超时",
+    409: "请求冲突",
+    429: "请求过于频繁（限流）",
+    500: "服务器内部错误",
+    502: "网关错误",
+    503: "服务暂时不可用",
+    504: "网关超时",
+}
+
+
+# raised once a request still fails after every retry, with a message fit for the user
+class RequestFailed(RuntimeError):
+    def __init__(self, error, attempts):
+        self.error = error
+        self.attempts = attempts
+        status = getattr(error, "status_code", None)
+        if status:
+            reason = f"HTTP {status} {STATUS_REASONS.get(status, '')}".strip()
+        elif isinstance(error, openai.APITimeoutError):
+            reason = "连接超时"
+        elif isinstance(error, openai.APIConnectionError):
+            reason = "无法连接到 API 服务器"
+        else:
+            reason = type(error).__name__
+        super().__init__(f"API 请求失败：{reason}，已尝试 {attempts} 次（{error}）")
+
+
+# retries of api requests: jittered exponential backoff, honouring Retry-After
+class RetryPolicy:
+    def __init__(self, max_retries=4, base_delay=0.5, max_delay=30.0):
+        # max_retries: tries after the first one, 0 to fail at once
+        # delays are drawn from [0, min(max_delay, base_delay * 2 ** attempt)] (full jitter)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def retryable(self, error):
+        if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+            return True
+        return isinstance(error, openai.APIStatusError) and error.status_code in RETRY_STATUSES
+
+    # seconds asked by the server in Retry-After (or retry-after-ms), None if not given
+    def retry_after(self, error):
+        response = getattr(error, "response", None)
+        if response is None:
+            return None
+        headers = response.headers
+        try:
+            if headers.get("retry-after-ms"):
+                return float(headers["retry-after-ms"]) / 1000
+            value = headers.get("retry-after")
+            if not value:
+                return None
+            if value.strip().isdigit():
+                return float(value)
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    # seconds to wait before try number attempt + 1
+    def delay(self, attempt, error):
+        asked = self.retry_after(error)
+        if asked is not None:
+            return min(asked, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    # the delay before the next try, raises RequestFailed (or the error itself) if there is none
+    def next_delay(self, attempt, error):
+        if not self.retryable(error):
+            raise error
+        if attempt >= self.max_retries:
+            raise RequestFailed(error, attempt + 1) from error
+        wait = self.delay(attempt, error)
+        print(f"[Warning] API 请求失败（{type(error).__name__}），{wait:.1f} 秒后第 {attempt + 1} 次重试")
+        return wait
+
+    def call(self, func, *args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except openai.OpenAIError as e:
+                time.sleep(self.next_delay(attempt, e))
+                attempt += 1
+
+    async def acall(self, func, *args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return await func(*args, **kwargs)
+            except openai.OpenAIError as e:
+                await asyncio.sleep(self.next_delay(attempt, e))
+                attempt += 1
+
+
+# global requests-per-minute limit, shared by every thread (and event loop) making requests
+# requests are spaced evenly, each caller waits for the next free slot
+class RateLimiter:
+    def __init__(self, rpm):
+        self.interval = 60.0 / rpm
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+
+    # take the next slot, returns the seconds to wait for it
+    def reserve(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+            return slot - now
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+# http connections shared by every AI instance of the process
+# one keep-alive pool, so re-initializing the gui or opening more sessions reuses connections and TLS
+class ClientPool:
+    def __init__(self, max_connections=20, max_keepalive=10, timeout=600.0, connect_timeout=10.0):
+        # max_connections: requests in flight at once, further ones wait for a free connection
+        # max_keepalive: idle connections kept open
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive)
+        # pool=None: waiting for a free connection is queueing, not an error
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout, pool=None)
+        self.http = DefaultHttpxClient(limits=self.limits, timeout=self.timeout)
+        # async pools are bound to the event loop they run on: {loop: httpx.AsyncClient}
+        self.ahttp = {}
+        self.lock = threading.Lock()
+
+    # openai client on the shared pool; retries are left to RetryPolicy
+    def client(self, api_key, base_url):
+        return OpenAI(api_key=api_key, base_url=base_url, http_client=self.http,
+                      max_retries=0, timeout=self.timeout)
+
+    # async openai client on the shared pool of loop (an asyncio loop, or any key standing for one)
+    def aclient(self, api_key, base_url, loop):
+        with self.lock:
+            if loop not in self.ahttp:
+                self.ahttp[loop] = DefaultAsyncHttpxClient(limits=self.limits, timeout=self.timeout)
+            http = self.ahttp[loop]
+        return AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http,
+                           max_retries=0, timeout=self.timeout)
+
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+# the ClientPool shared by all AI instances, created with kwargs on first use
+def shared_pool(**kwargs):
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = ClientPool(**kwargs)
+        return _shared_pool
@@ -0,0 +1,92 @@
+import json
+from functools import lru_cache
+
+
+# estimated tokens of a text, following deepseek's rule of thumb:
+# 1 english char ~ 0.3 token, 1 chinese char ~ 0.6 token
+# cached, since the same history messages are counted again every step
+@lru_cache(maxsize=4096)
+def estimate_tokens(text):
+    if not text:
+        return 0
+    wide = sum(1 for ch in text if ord(ch) > 0x2e7f)
+    return int((len(text) - wide) * 0.3 + wide * 0.6) + 1
+
+
+# keeps the conversation sent to the api within a token budget
+# old tool results are summarized first, then the oldest whole turns are dropped
+class ContextManager:
+    def __init__(self, max_tokens=48000, keep_recent=2, tool_result_prefix="执行结果："):
+        # max_tokens: budget of the whole message list, None or 0 for no limit
+        # keep_recent: number of latest tool results always kept in full
+        self.max_tokens = max_tokens
+        self.keep_recent = keep_recent
+        self.tool_result_prefix = tool_result_prefix
+
+        # marks a summarized tool result, so it is never summarized twice
+        self.summary_mark = "…（较早的工具结果已省略"
+        self.summary_len = 200
+
+    # estimated tokens of one message, 4 tokens for role and framing
+    def msg_tokens(self, msg):
+        tokens = 4 + estimate_tokens(msg.get("content") or "")
+        if msg.get("tool_calls"):
+            tokens += estimate_tokens(json.dumps(msg["tool_calls"], ensure_ascii=False))
+        return tokens
+
+    def count(self, messages):
+        return sum(self.msg_tokens(m) for m in messages)
+
+    # whether the message carries the result of a tool execution
+    def is_tool_result(self, msg):
+        if msg.get("role") == "tool":
+            return True
+        return msg.get("role") == "user" and (msg.get("content") or "").startswith(self.tool_result_prefix)
+
+    # returns a copy of msg with its content cut down to a short summary
+    def summarize(self, msg):
+        content = msg.get("content") or ""
+        if self.summary_mark in content or len(content) <= self.summary_len:
+            return msg
+        short = dict(msg)
+        short["content"] = content[:self.summary_len] + f"{self.summary_mark}，原长约 {estimate_tokens(content)} tokens）"
+        return short
+
+    # returns the message list fitted to the budget, messages themselves are not modified
+    # exactly one system message is kept: the latest one, placed first
+    def fit(self, messages):
+        systems = [m for m in messages if m.get("role") == "system"]
+        rest = [m for m in messages if m.get("role") != "system"]
+        head = systems[-1:]
+
+        if not self.max_tokens:
+            return head + rest
+
+        total = self.count(head) + self.count(rest)
+        if total <= self.max_tokens:
+            return head + rest
+        before = total
+
+        # summarize old tool results, oldest first
+        tool_idx = [i for i, m in enumerate(rest) if self.is_tool_result(m)]
+        old_idx = tool_idx[:-self.keep_recent] if self.keep_recent else tool_idx
+        for i in old_idx:
+            if total <= self.max_tokens:
+                break
+            short = self.summarize(rest[i])
+            total -= self.msg_tokens(rest[i]) - self.msg_tokens(short)
+            rest[i] = short
+
+        # drop oldest turns, a turn starts at a user message which is not a tool result
+        # whole turns are dropped so tool calls never lose their results
+        turns = []
+        for m in rest:
+            if not turns or (m.get("role") == "user" and not self.is_tool_result(m)):
+                turns.append([])
+            turns[-1].append(m)
+        while total > self.max_tokens and len(turns) > 1:
+            total -= self.count(turns.pop(0))
+
+        if total < before:
+            print(f"[Info] 上下文已压缩：约 {before} → {total} tokens")
+        return head + [m for turn in turns for m in turn]
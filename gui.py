@@ -7,11 +7,11 @@ from PySide6.QtWidgets import (
         QMainWindow, QSlider, QProgressDialog
 )
 from PySide6.QtGui import  QFont, QFontMetrics,QPixmap, QDragEnterEvent, QDropEvent,QIcon, QAction
-from PySide6.QtCore import Qt, QTimer, Signal, QThread
+from PySide6.QtCore import Qt, QTimer, Signal, QObject
 from PySide6.QtWidgets import QSplitter, QListWidget, QListWidgetItem, QWidget, QLabel
 from PySide6.QtCore import QMimeData, QSize
 
-from aiclass import AI
+from aiclass import AsyncAI, CancelToken
 
 
 # window for initialization : ask for ds_api key and mcp dirs
@@ -189,24 +189,43 @@ class settings(QWidget):
         self.close()
 
 
-# multi-threading class
-# done by vibe-coding, no explainations
-class AIThread(QThread):
-    finished = Signal(str)
-    error = Signal(str)
+# bridge between the event loop of AsyncAI and the GUI
+# every message is a coroutine on the one event loop instead of a QThread of its own,
+# so several chats can wait for replies at once
+# signals are emitted in the loop's thread, Qt queues them into the GUI thread
+class AIBridge(QObject):
+    # args: chat name, text
+    finished = Signal(str, str)
+    error = Signal(str, str)
+    delta = Signal(str, str)
     
-    def __init__(self, ai_instance, message):
+    def __init__(self, ai_instance):
         super().__init__()
         self.ai_instance = ai_instance
-        self.message = message
-        
-    def run(self):
+        # CancelToken of every chat waiting for a reply: {chat: token}
+        self.tokens = {}
+    
+    # send message in the conversation conv of chat
+    def send(self, chat: str, message: str, conv: list):
+        cancel = self.tokens[chat] = CancelToken()
+        coro = self.ai_instance.aprocess_user_inp(message, on_delta=lambda d: self.delta.emit(chat, d),
+                                                  conv_his=conv, cancel=cancel)
+        future = self.ai_instance.submit(coro)
+        future.add_done_callback(lambda f: self.done(chat, f))
+    
+    # stop the reply of chat, the partial reply still arrives through finished
+    def stop(self, chat: str):
+        cancel = self.tokens.get(chat)
+        if cancel is not None:
+            cancel.cancel()
+    
+    def done(self, chat: str, future):
+        self.tokens.pop(chat, None)
         try:
-            response, _ = self.ai_instance.process_user_inp(self.message)
-            if response:
-                self.finished.emit(response)
+            response, _ = future.result()
+            self.finished.emit(chat, response)
         except Exception as e:
-            self.error.emit(str(e))
+            self.error.emit(chat, str(e))
 
 # main body of GUI, the window for chat
 
@@ -230,6 +249,10 @@ class ChatBox(QWidget):
         self.system_prompt = ""
         self.temperature = 10
         self.ai = None
+        self.bridge = None
+        
+        # conversation sent to ai of every chat: {chat: [messages]}
+        self.conversations = {}
         
         # current chat
         self.current_chat_target = "Chat A"
@@ -242,6 +265,12 @@ class ChatBox(QWidget):
         # chat histroy storage: {Object: [chat, messages]}
         self.chat_records = {}
         
+        # chats waiting for a reply, the text streamed so far and the bubble growing with it
+        # stream_bubbles: {chat: (content_widget, content_label) returned by 'add_message'}
+        self.busy_chats = set()
+        self.stream_texts = {}
+        self.stream_bubbles = {}
+        
         # Main UI Initialization
         self.initUI()
         
@@ -272,6 +301,7 @@ class ChatBox(QWidget):
         if (self.DS_API_KEY and self.DS_API_KEY.startswith("sk-")):
             self.init_but.setVisible(False)
             self.send_button.setVisible(True)
+            self.stop_button.setVisible(True)
             self.settings_but.setVisible(True)
             
             # uncertain progress dialog
@@ -284,7 +314,11 @@ class ChatBox(QWidget):
             
 
             try:
-                self.ai = AI(mcp_paths=self.mcp_files, api_key=api_key)
+                self.ai = AsyncAI(mcp_paths=self.mcp_files, api_key=self.DS_API_KEY)
+                self.bridge = AIBridge(self.ai)
+                self.bridge.finished.connect(lambda chat, msg: self.reply_message(msg, chat))
+                self.bridge.error.connect(lambda chat, err: self.reply_message(f"错误：{err}", chat))
+                self.bridge.delta.connect(self.stream_message)
                 self.temperature = int(self.ai.temperature * 10)   
                 self.system_prompt = self.ai.system_prompt   
                 self.progress_dialog.close()
@@ -318,6 +352,7 @@ class ChatBox(QWidget):
         self.ai.add_mcp_mods(addition_mcp_files)
         self.system_prompt = self.ai.system_prompt
         self.ai.temperature = float(self.temperature) / 10.0  
+        # chats pick up the new system prompt on their next turn, aprocess_user_inp sets it every turn
                 
         
     # main body for main window ( weired sentence
@@ -388,6 +423,11 @@ class ChatBox(QWidget):
         self.send_button.setShortcut('ctrl+return')
         self.send_button.clicked.connect(self.send_message)
         
+        # button: stop, enabled while the current chat waits for its reply
+        self.stop_button = QPushButton('停止')
+        self.stop_button.setEnabled(False)
+        self.stop_button.clicked.connect(self.stop_message)
+        
         # button: settings
         self.settings_but = QPushButton('设置')
         self.settings_but.clicked.connect(lambda: self.open_settings(self.system_prompt, self.temperature))
@@ -402,10 +442,12 @@ class ChatBox(QWidget):
         if self.DS_API_KEY:
             self.init_but.setVisible(False)
             self.send_button.setVisible(True)
+            self.stop_button.setVisible(True)
             self.settings_but.setVisible(True)
         else:
             self.init_but.setVisible(True)
             self.send_button.setVisible(False)
+            self.stop_button.setVisible(False)
             self.settings_but.setVisible(False)
     
     
@@ -419,6 +461,7 @@ class ChatBox(QWidget):
         # build a layout in the bottom area, especially for buttons in the right area
         button_layout = QGridLayout()
         button_layout.addWidget(self.send_button, 0, 1)
+        button_layout.addWidget(self.stop_button, 0, 2)
         button_layout.addWidget(self.init_but, 0, 1)
         button_layout.addWidget(self.settings_but, 0, 0)
         
@@ -503,6 +546,15 @@ class ChatBox(QWidget):
         # load msg from current chat
         for msg in self.chat_records.get(self.current_chat_target, []):
             self.add_message(msg["text"], msg["is_sender"])
+        
+        # streaming bubbles are deleted with the layout, the one of this chat is rebuilt
+        self.stream_bubbles = {}
+        if self.stream_texts.get(self.current_chat_target):
+            self.stream_bubbles[self.current_chat_target] = self.add_message(self.stream_texts[self.current_chat_target], is_sender=False)
+        
+        # every chat waits for its own reply
+        self.send_button.setEnabled(self.current_chat_target not in self.busy_chats)
+        self.stop_button.setEnabled(self.current_chat_target in self.busy_chats)
 
     def clear_chat_layout(self):
         """clear current chat area"""
@@ -575,11 +627,16 @@ class ChatBox(QWidget):
             # clear the text_edit in the input area
             self.input_box_text_edit.clear()
             self.send_button.setEnabled(False)
+            self.stop_button.setEnabled(True)
             
-            self.ai_thread = AIThread(self.ai, message)
-            self.ai_thread.finished.connect(lambda: self.send_button.setEnabled(True))
-            self.ai_thread.finished.connect(self.reply_message)
-            self.ai_thread.start()
+            chat = self.current_chat_target
+            self.busy_chats.add(chat)
+            self.stream_texts[chat] = ""
+            
+            # every chat keeps its own conversation with ai
+            if chat not in self.conversations:
+                self.conversations[chat] = self.ai.new_conversation()
+            self.bridge.send(chat, message, self.conversations[chat])
                     
             return message
         
@@ -588,24 +645,67 @@ class ChatBox(QWidget):
     
             
 
-    def reply_message(self, msg: str):
+    def reply_message(self, msg: str, chat: str = None):
         """
         reply message
         
         args:
         - msg: the message you wanna reply to sender and render in the chatting area        
+        - chat: the chat replied to, current chat by default
         """
         reply_msg_str = msg
+        chat = chat or self.current_chat_target
         
         # similar usage above in 'send_message'
-        self.chat_records[self.current_chat_target].append({
+        self.chat_records[chat].append({
             "text": reply_msg_str,
             "is_sender": False,
             "file_path": None
         })
         
         # render the reply message in the chatting area
-        self.add_message(reply_msg_str, is_sender=False)
+        # a streamed reply already has its bubble, only the final text is set
+        bubble = self.stream_bubbles.pop(chat, None)
+        if bubble is not None:
+            self.fit_bubble(*bubble, reply_msg_str)
+            self.scroll_to_bottom()
+        elif chat == self.current_chat_target:
+            self.add_message(reply_msg_str, is_sender=False)
+        
+        self.stream_texts.pop(chat, None)
+        self.busy_chats.discard(chat)
+        if chat == self.current_chat_target:
+            self.send_button.setEnabled(True)
+            self.stop_button.setEnabled(False)
+
+
+    def stop_message(self):
+        """
+        stop the reply of the current chat
+        
+        the reply received so far arrives in 'reply_message' as usual, marked as stopped
+        """
+        if self.current_chat_target in self.busy_chats:
+            self.bridge.stop(self.current_chat_target)
+            self.stop_button.setEnabled(False)
+
+
+    def stream_message(self, chat: str, delta: str):
+        """
+        render a reply while it is streamed, growing one bubble in place
+        
+        args:
+        - chat: the chat replied to
+        - delta: new piece of text of the reply
+        """
+        self.stream_texts[chat] = self.stream_texts.get(chat, "") + delta
+        if chat != self.current_chat_target:
+            return
+        if chat not in self.stream_bubbles:
+            self.stream_bubbles[chat] = self.add_message(self.stream_texts[chat], is_sender=False)
+        else:
+            self.fit_bubble(*self.stream_bubbles[chat], self.stream_texts[chat])
+            self.scroll_to_bottom()
 
 
     def add_message(self, message: str, is_sender: bool):
@@ -617,6 +717,8 @@ class ChatBox(QWidget):
         args:
         - message: text you wanna render
         - is_sender: True / False whether the message comes from the user
+        
+        return (content_widget, content_label) of the bubble, used by 'fit_bubble'
         """
 
         # calculate the proper max width of massage bubble
@@ -658,6 +760,36 @@ class ChatBox(QWidget):
         content_label.setStyleSheet("background: transparent;")
         content_label.setTextInteractionFlags(Qt.TextInteractionFlag.TextSelectableByMouse)
 
+        self.fit_bubble(content_widget, content_label, message)
+
+        content_layout = QVBoxLayout(content_widget)
+        content_layout.addWidget(content_label)
+
+        message_layout.addWidget(content_widget)
+        message_layout.setAlignment(Qt.AlignmentFlag.AlignRight if is_sender else Qt.AlignmentFlag.AlignLeft)
+
+        self.chat_layout.addWidget(message_widget)
+        self.chat_layout.addSpacing(10)
+        
+        # auto-scroll to the bottom
+        self.scroll_to_bottom()
+        
+        return content_widget, content_label
+
+
+    def fit_bubble(self, content_widget: QWidget, content_label: QLabel, message: str):
+        """
+        set the text of a bubble and resize the bubble to fit it
+        
+        args:
+        - content_widget, content_label: the bubble returned by 'add_message'
+        - message: text of the bubble
+        """
+        content_label.setText(message)
+        
+        chat_width = self.scroll_area.viewport().width() if self.scroll_area.viewport() else 600
+        max_bubble_width = min(int(chat_width * 0.66), 400) 
+        
         # I AM A TAILOR FOR EVERY FONT !
         font = content_label.font()
         fm = QFontMetrics(font)
@@ -680,18 +812,6 @@ class ChatBox(QWidget):
         # max width = bubble_width - padding
         content_label.setMaximumWidth(bubble_width - 20)
 
-        content_layout = QVBoxLayout(content_widget)
-        content_layout.addWidget(content_label)
-
-        message_layout.addWidget(content_widget)
-        message_layout.setAlignment(Qt.AlignmentFlag.AlignRight if is_sender else Qt.AlignmentFlag.AlignLeft)
-
-        self.chat_layout.addWidget(message_widget)
-        self.chat_layout.addSpacing(10)
-        
-        # auto-scroll to the bottom
-        self.scroll_to_bottom()
-
 
     # auto-scroll to the bottom when new msg comes
     def scroll_to_bottom(self):
@@ -0,0 +1,263 @@
+import os
+import hmac
+import json
+import time
+import secrets
+import argparse
+import threading
+import socketserver
+from collections import Counter
+
+from mcp_utils import MCPServerManager, ToolListCache, BROKER_PORT, BROKER_TOKEN_PATH
+
+
+# local daemon owning MCP server processes, shared by every AI of every process on this machine
+# a gui re-init, a new session or a batch run reuses the running servers instead of spawning
+# its own npx / uvx processes; MCPServerManager connects to it when it is running
+#
+#   uv run python ./mcp_broker.py
+#   uv run python ./mcp_broker.py --port 8765 --idle 300
+#
+# protocol: one json object per line over tcp 127.0.0.1, every request has an "id" echoed in its reply
+#   {"op": "hello", "token"}                              -> {}   first line of every connection
+#   {"op": "acquire", "config", "server"}                 -> {"key", "tools"}
+#   {"op": "call", "key", "tool", "args", "call_timeout"} -> {"result"}
+#   {"op": "release", "key"}                              -> {}
+#   {"op": "stats"}                                       -> {"servers": {key: {...}}}
+# failures are answered with {"error": message}
+# the token is written to BROKER_TOKEN_PATH (this user only) on start, a connection whose first line
+# is not a hello with it is dropped; acquire names a server of a config file, whose command the broker
+# reads from the file itself, so a request never carries a command line to run
+
+
+# daemon_threads: connections do not keep the broker alive
+# no SO_REUSEADDR on windows, there it lets a second process bind the same port
+class BrokerServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = os.name != "nt"
+
+
+class MCPBroker:
+    def __init__(self, port=BROKER_PORT, idle=300, token_path=BROKER_TOKEN_PATH):
+        # idle: seconds a server without users keeps running,
+        #       and the broker itself once it has neither servers nor clients
+        self.port = port
+        self.idle = idle
+        self.token_path = token_path
+        self.token = secrets.token_hex(32)
+        self.manager = MCPServerManager()
+        self.manager.tool_cache = ToolListCache()
+        # users of every server over all connections: {key: count}, idle_since: {key: time of the last release}
+        self.refs = Counter()
+        self.idle_since = {}
+        self.start_locks = {}
+        self.lock = threading.Lock()
+        self.clients = 0
+        self.last_active = time.time()
+        self.server = None
+
+    # key of a server config: the same command and args share one process
+    def server_key(self, ser_conf):
+        name = os.path.basename(str(ser_conf["command"]))
+        return f"{name}-{self.manager.tool_cache.make_key(ser_conf)[:12]}"
+
+    def running(self, key):
+        process = self.manager.processes.get(key)
+        return process is not None and process.poll() is None
+
+    # launch config of server ser_name in the MCP config file conf_path, as MCPServerManager.parse_config builds it
+    def read_server_conf(self, conf_path, ser_name):
+        if not conf_path.endswith('.json'):
+            raise RuntimeError("只接受 .json 格式的MCP配置文件")
+        try:
+            with open(conf_path, 'r', encoding='utf-8') as f:
+                ser_conf = json.load(f)["mcpServers"][ser_name]
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            raise RuntimeError(f"配置文件 {conf_path} 中没有服务器 {ser_name}：{type(e).__name__}")
+        return {
+            "command": ser_conf["command"],
+            "args": ser_conf.get("args", []),
+            "timeout": ser_conf.get("timeout", 30),
+        }
+
+    def acquire(self, conf_path, ser_name):
+        ser_conf = self.read_server_conf(conf_path, ser_name)
+        key = self.server_key(ser_conf)
+        with self.lock:
+            start_lock = self.start_locks.setdefault(key, threading.Lock())
+        # one start per server, clients asking meanwhile wait for it
+        with start_lock:
+            if not self.running(key):
+                self.manager.servers[key] = ser_conf
+                if not self.manager.launch(key):
+                    raise RuntimeError(f"服务器启动失败：{' | '.join(self.manager.stderr_tail(key, 3))}")
+            with self.lock:
+                self.refs[key] += 1
+                self.idle_since.pop(key, None)
+        return key
+
+    def release(self, key):
+        with self.lock:
+            if self.refs[key] > 0:
+                self.refs[key] -= 1
+            if self.refs[key] == 0:
+                self.idle_since[key] = time.time()
+
+    # answer one request of a client, acquired: Counter of the keys held by its connection
+    def handle(self, req, acquired):
+        op = req.get("op")
+        if op == "acquire":
+            key = self.acquire(str(req["config"]), req["server"])
+            acquired[key] += 1
+            return {"key": key, "tools": self.manager.tools.get(key, [])}
+        if op == "call":
+            if not self.running(req["key"]):
+                raise RuntimeError("服务器未运行")
+            result = self.manager.call_tool(req["key"], req["tool"], req.get("args") or {},
+                                            req.get("call_timeout", 60))
+            return {"result": result}
+        if op == "release":
+            if acquired[req["key"]] > 0:
+                acquired[req["key"]] -= 1
+                self.release(req["key"])
+            return {}
+        if op == "stats":
+            return {"servers": {key: {"command": conf["command"], "running": self.running(key),
+                                      "refs": self.refs[key], "latency": self.manager.latency_stats(key)}
+                                for key, conf in list(self.manager.servers.items())}}
+        raise RuntimeError(f"未知操作：{op}")
+
+    # stop an idle server under its start lock, so no acquire can take it up meanwhile
+    # a client that acquired it since it went idle keeps it running
+    def reap(self, key):
+        with self.start_locks[key]:
+            with self.lock:
+                if self.refs[key] > 0:
+                    return
+            print(f"[Info] 服务器 {key} 空闲超过 {self.idle} 秒，已停止")
+            self.manager.stop_ser(key)
+            self.manager.servers.pop(key, None)
+            self.manager.processes.pop(key, None)
+
+    # stops servers unused for idle seconds, and the broker once nothing is left
+    def reap_loop(self):
+        while True:
+            time.sleep(min(5, self.idle))
+            now = time.time()
+            with self.lock:
+                expired = [key for key, since in self.idle_since.items() if now - since >= self.idle]
+                for key in expired:
+                    del self.idle_since[key]
+            for key in expired:
+                self.reap(key)
+            with self.lock:
+                busy = self.clients or any(self.running(key) for key in list(self.manager.servers))
+                if busy:
+                    self.last_active = now
+                elif now - self.last_active >= self.idle:
+                    print(f"[Info] 没有客户端和服务器超过 {self.idle} 秒，MCP 代理退出")
+                    threading.Thread(target=self.server.shutdown, daemon=True).start()
+                    return
+
+    # True if the first line of a connection is a hello with the token
+    def authorized(self, line):
+        try:
+            req = json.loads(line)
+        except ValueError:
+            return False
+        return (isinstance(req, dict) and req.get("op") == "hello" and isinstance(req.get("token"), str)
+                and hmac.compare_digest(req["token"], self.token))
+
+    # write the token readable by this user only, after the port is bound so a second broker
+    # failing to start never replaces the token of the running one
+    def save_token(self):
+        os.makedirs(os.path.dirname(self.token_path), mode=0o700, exist_ok=True)
+        tmp_path = f"{self.token_path}.{os.getpid()}"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(self.token)
+        os.replace(tmp_path, self.token_path)
+
+    def remove_token(self):
+        try:
+            with open(self.token_path, 'r', encoding='utf-8') as f:
+                if f.read().strip() != self.token:
+                    return
+            os.remove(self.token_path)
+        except OSError:
+            pass
+
+    def serve_forever(self):
+        broker = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                # anything else than a hello with the token (another user, an http request) is dropped
+                first = self.rfile.readline(4096)
+                if not broker.authorized(first):
+                    return
+                self.wfile.write((json.dumps({"id": json.loads(first).get("id")}) + "\n").encode("utf-8"))
+                self.wfile.flush()
+                
+                acquired = Counter()
+                write_lock = threading.Lock()
+                with broker.lock:
+                    broker.clients += 1
+
+                def answer(req):
+                    try:
+                        resp = broker.handle(req, acquired)
+                    except Exception as e:
+                        resp = {"error": str(e)}
+                    resp["id"] = req.get("id")
+                    data = (json.dumps(resp, ensure_ascii=False) + "\n").encode("utf-8")
+                    try:
+                        with write_lock:
+                            self.wfile.write(data)
+                            self.wfile.flush()
+                    except OSError:
+                        pass
+
+                try:
+                    for line in self.rfile:
+                        try:
+                            req = json.loads(line)
+                        except ValueError:
+                            continue
+                        # requests of one client run concurrently, replies are matched by id
+                        threading.Thread(target=answer, args=(req,), daemon=True).start()
+                except OSError:
+                    pass
+                finally:
+                    # a client that goes away releases whatever it still holds
+                    for key, count in acquired.items():
+                        for _ in range(count):
+                            broker.release(key)
+                    with broker.lock:
+                        broker.clients -= 1
+
+        self.server = BrokerServer(("127.0.0.1", self.port), Handler)
+        try:
+            self.save_token()
+            threading.Thread(target=self.reap_loop, daemon=True).start()
+            print(f"[Info] MCP 代理已启动：127.0.0.1:{self.port}，空闲 {self.idle} 秒后停止服务器")
+            self.server.serve_forever()
+        finally:
+            self.remove_token()
+            self.server.server_close()
+            self.manager.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="local broker sharing MCP servers between Deepseek Desktop sessions")
+    parser.add_argument("--port", type=int, default=BROKER_PORT, help="tcp port on 127.0.0.1")
+    parser.add_argument("--idle", type=float, default=300, help="seconds an unused server (and the idle broker) keeps running")
+    opts = parser.parse_args()
+    try:
+        MCPBroker(opts.port, opts.idle).serve_forever()
+    except KeyboardInterrupt:
+        print("\n[Info] MCP 代理已停止")
+
+
+if __name__ == "__main__":
+    main()
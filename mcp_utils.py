@@ -2,18 +2,222 @@ import json
 import subprocess
 import os
 import time
-import queue
+import socket
+import hashlib
+import itertools
 import threading
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+
+# tools/list results of every server seen so far, saved across runs
+# keyed by a hash of the server's command and args, so renaming a server or editing
+# another one in the config keeps the entry, while changing how it is launched drops it
+class ToolListCache:
+    def __init__(self, path=".cache/mcp_tools.json"):
+        self.path = path
+        self.data = {}
+        self.lock = threading.Lock()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            pass
+    
+    def make_key(self, ser_conf):
+        launch = json.dumps([ser_conf["command"], ser_conf.get("args", [])], ensure_ascii=False)
+        return hashlib.sha256(launch.encode('utf-8')).hexdigest()
+    
+    # cached tools of a server config, None if it was never listed
+    def get(self, ser_conf):
+        with self.lock:
+            return self.data.get(self.make_key(ser_conf))
+    
+    # store the live tools of a server, returns True if they differ from the cached ones
+    def put(self, ser_conf, tools):
+        key = self.make_key(ser_conf)
+        with self.lock:
+            if self.data.get(key) == tools:
+                return False
+            self.data[key] = tools
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path, 'w', encoding='utf-8') as f:
+                    json.dump(self.data, f, ensure_ascii=False)
+            except OSError as e:
+                print(f"[Warning] 保存MCP工具列表缓存失败：{e}")
+            return True
+
+
+# port of the local MCP broker, see mcp_broker.py
+BROKER_PORT = 8765
+# secret of the running broker, readable by this user only; every client proves it knows it first,
+# so other users and web pages posting to 127.0.0.1 cannot make the broker start anything
+BROKER_TOKEN_PATH = os.path.join(os.path.expanduser("~"), ".cache", "deepseek_desktop", "mcp_broker.token")
+
+
+def read_broker_token(path=BROKER_TOKEN_PATH):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+# client of a running mcp_broker.py: newline delimited json over a local tcp socket
+# requests carry an id and may be answered out of order, as in MCPServerManager.request
+class BrokerClient:
+    def __init__(self, sock):
+        self.sock = sock
+        self.reader = sock.makefile('rb')
+        self.ids = itertools.count(1)
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.closed = False
+        threading.Thread(target=self.read_loop, daemon=True).start()
+    
+    def read_loop(self):
+        try:
+            for line in self.reader:
+                try:
+                    msg = json.loads(line)
+                except ValueError:
+                    continue
+                with self.lock:
+                    future = self.pending.pop(msg.get('id'), None)
+                if future is not None:
+                    future.set_result(msg)
+        except OSError:
+            pass
+        # broker gone: fail what is still waiting
+        with self.lock:
+            self.closed = True
+            pending, self.pending = self.pending, {}
+        for future in pending.values():
+            future.set_result({"error": "MCP 代理连接已断开"})
+    
+    # send one request and wait for its reply, raises RuntimeError with the broker's error
+    def request(self, op, timeout=None, **params):
+        req_id = next(self.ids)
+        future = Future()
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("MCP 代理连接已断开")
+            self.pending[req_id] = future
+        try:
+            data = (json.dumps(dict(params, id=req_id, op=op), ensure_ascii=False) + '\n').encode('utf-8')
+            with self.write_lock:
+                self.sock.sendall(data)
+            resp = future.result(timeout=timeout)
+        except (OSError, FutureTimeout) as e:
+            with self.lock:
+                self.pending.pop(req_id, None)
+            raise RuntimeError(f"MCP 代理请求失败：{type(e).__name__}") from e
+        if 'error' in resp:
+            raise RuntimeError(resp['error'])
+        return resp
+    
+    # first request of a connection, the broker drops connections that fail it
+    def hello(self, token):
+        return self.request("hello", timeout=5, token=token)
+    
+    # the broker's server ser_name of the config file conf_path, started if needed
+    # the broker reads the command from the file itself, a client cannot make it run anything else
+    # returns (key of the server, its tools); the broker counts this client as one more user
+    def acquire(self, conf_path, ser_name):
+        resp = self.request("acquire", config=conf_path, server=ser_name)
+        return resp['key'], resp['tools']
+    
+    def release(self, key):
+        return self.request("release", timeout=5, key=key)
+    
+    def call(self, key, tool_name, args, timeout=60):
+        # a little longer than the broker's own timeout, so its error arrives first
+        return self.request("call", timeout=timeout + 5, key=key, tool=tool_name, args=args,
+                            call_timeout=timeout)['result']
+    
+    # the broker releases whatever this connection still holds when it goes away
+    def close(self):
+        try:
+            # the reader's file keeps the socket open, shutdown ends the connection for both sides
+            self.sock.shutdown(socket.SHUT_RDWR)
+            self.sock.close()
+        except OSError:
+            pass
+
+
+_shared_broker = None
+_shared_broker_lock = threading.Lock()
+
+# the BrokerClient shared by the process, None if no broker is running on port
+# tried again on every call while there is no live connection, refused connects are fast
+def shared_broker(port=BROKER_PORT, token_path=BROKER_TOKEN_PATH):
+    global _shared_broker
+    with _shared_broker_lock:
+        if _shared_broker is None or _shared_broker.closed:
+            _shared_broker = None
+            # no token file: no broker of this user is running
+            token = read_broker_token(token_path)
+            if not token:
+                return None
+            try:
+                sock = socket.create_connection(("127.0.0.1", port), timeout=0.5)
+                sock.settimeout(None)
+            except OSError:
+                return None
+            client = BrokerClient(sock)
+            try:
+                client.hello(token)
+            except RuntimeError as e:
+                print(f"[Warning] MCP 代理拒绝连接：{e}")
+                client.close()
+                return None
+            _shared_broker = client
+            print(f"[Info] 已连接 MCP 代理（端口 {port}）")
+        return _shared_broker
+
 
 class MCPServerManager:
     
-    def __init__(self):
+    # broker: optional BrokerClient, servers are then started (or reused) by the broker
+    def __init__(self, broker=None):
         self.servers = {}
         self.processes = {}
         self.tools = {}
-        self.output_queues = {}
         self.stop_events = {}
         self.read_threads = {}
+        
+        # json-rpc state: ids are unique over all servers of the manager
+        # pending: {server name: {request id: Future of the response}}, filled by the read threads
+        # write_locks: one per server, so concurrent requests do not interleave on stdin
+        # subscribers: {method: [callback(server name, message)]}, "*" gets every notification
+        self.ids = itertools.count(1)
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.write_locks = {}
+        self.subscribers = {}
+        
+        # last lines of every server's stderr: {server name: deque}, see stderr_tail
+        self.stderr_tails = {}
+        self.stderr_threads = {}
+        # round trips of recent requests: {server name: deque of (method, seconds)}, see latency_stats
+        self.latencies = {}
+        # seconds from spawning each server to its tool list, see start_all
+        self.startup_times = {}
+        
+        # optional ToolListCache, updated with every tools/list response
+        # ready_events: set once a server started in the background (see warm_start) is up or failed
+        # on_tools_changed: callback(server name) when a warm started server lists other tools than cached
+        self.tool_cache = None
+        self.ready_events = {}
+        self.on_tools_changed = None
+        
+        # servers provided by the broker: {server name: broker key}
+        self.broker = broker
+        self.broker_keys = {}
+        # absolute path of the config file the servers come from, the broker reads them from it
+        self.conf_path = None
     
     def parse_config(self, conf_json):
         # 解析MCP
@@ -24,7 +228,9 @@ class MCPServerManager:
             for ser_name, ser_conf in mcp_servers.items():
                 self.servers[ser_name] = {
                     "command": ser_conf["command"],
-                    "args": ser_conf.get("args", [])
+                    "args": ser_conf.get("args", []),
+                    # seconds allowed for the handshake, a cold `npx -y` may download the server first
+                    "timeout": ser_conf.get("timeout", 30)
                 }
             return True
         except Exception as e:
@@ -45,176 +251,325 @@ class MCPServerManager:
                                     any('npx' in str(arg).lower() for arg in [ser_conf["command"]] + ser_conf["args"])):
                 use_shell = True
             
+            # binary pipes: messages are framed by b'\n' and decoded whole, however long they are
             process = subprocess.Popen(
                 [ser_conf["command"]] + ser_conf["args"],
                 stdin=subprocess.PIPE,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
-                text=True,
-                bufsize=1,
-                encoding='utf-8',
                 shell=use_shell          
             )
             self.processes[ser_name] = process
             
-            self.output_queues[ser_name] = queue.Queue()
             self.stop_events[ser_name] = threading.Event()
+            self.write_locks[ser_name] = threading.Lock()
+            self.stderr_tails[ser_name] = deque(maxlen=50)
+            self.latencies[ser_name] = deque(maxlen=1000)
+            with self.pending_lock:
+                self.pending[ser_name] = {}
             
             # 启动读取线程
-            def read_loop(proc, output_q, stop_flag):
+            # readline blocks until a whole line arrives, so the thread wakes only on data
+            def read_loop(proc, stop_flag):
                 """读取服务器输出的线程"""
-                while not stop_flag.is_set():
-                    try:
-                        line = proc.stdout.readline()
-                        if line:
-                            line = line.strip()
-                            output_q.put(line)
-                        else:
-                            time.sleep(0.1)
-                    except:
-                        break
+                try:
+                    for line in iter(proc.stdout.readline, b''):
+                        self.dispatch(ser_name, line.decode('utf-8', errors='replace').strip())
+                except Exception as e:
+                    print(f"[Warning] 读取服务器 {ser_name} 输出出错：{e}")
+                # stdout closed: the server exited (or is being stopped)
+                self.fail_pending(ser_name, proc, stop_flag.is_set())
+            
+            # stderr is drained too, a full pipe would block the server
+            def stderr_loop(proc, tail):
+                try:
+                    for line in iter(proc.stderr.readline, b''):
+                        # very long lines (dumped payloads) are cut, the tail is for error messages
+                        tail.append(line.decode('utf-8', errors='replace').rstrip()[:300])
+                except Exception:
+                    pass
             
             thread = threading.Thread(
                 target=read_loop,
-                args=(process, self.output_queues[ser_name], self.stop_events[ser_name]),
+                args=(process, self.stop_events[ser_name]),
                 daemon=True
             )
             thread.start()
             self.read_threads[ser_name] = thread
             
+            err_thread = threading.Thread(target=stderr_loop, args=(process, self.stderr_tails[ser_name]), daemon=True)
+            err_thread.start()
+            self.stderr_threads[ser_name] = err_thread
+            
             print(f"[Info] 启动 {ser_name} 成功")
-            time.sleep(1)
             
             return process
         except Exception as e:
             print(f"[Warning] 启动服务器失败: {e}")
             return None
     
-    def send_mcp_req(self, ser_name, req, timeout=3):
-        # send mcp requests
-        if ser_name not in self.processes:
+    # handle one line of a server's stdout, called by its read thread
+    # responses complete the future of their request, notifications go to the subscribers
+    def dispatch(self, ser_name, line):
+        if not line.startswith('{'):
+            return
+        try:
+            msg = json.loads(line)
+        except ValueError:
+            return
+        
+        if 'method' not in msg:
+            with self.pending_lock:
+                future = self.pending.get(ser_name, {}).pop(msg.get('id'), None)
+            # responses to requests that timed out are dropped
+            if future is not None:
+                future.set_result(msg)
+            return
+        
+        for callback in self.subscribers.get(msg['method'], []) + self.subscribers.get('*', []):
+            try:
+                callback(ser_name, msg)
+            except Exception as e:
+                print(f"[Warning] 处理通知 {msg['method']} 出错：{e}")
+        
+        # requests from the server: answer ping, refuse the rest
+        if 'id' in msg:
+            if msg['method'] == 'ping':
+                self.write_msg(ser_name, {"jsonrpc": "2.0", "id": msg['id'], "result": {}})
+            else:
+                self.write_msg(ser_name, {"jsonrpc": "2.0", "id": msg['id'],
+                                          "error": {"code": -32601, "message": f"Method not found: {msg['method']}"}})
+    
+    # fail the requests still waiting on a server whose stdout closed
+    # later requests to it fail at once, as for a server not started
+    def fail_pending(self, ser_name, process, stopping=False):
+        with self.pending_lock:
+            pending = self.pending.pop(ser_name, {})
+        try:
+            code = process.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            code = None
+        reason = f"服务器 {ser_name} 已退出（退出码 {code}）"
+        tail = self.stderr_tail(ser_name, 3)
+        if tail:
+            reason += "：" + " | ".join(tail)
+        if not stopping:
+            print(f"[Warning] {reason}")
+        for req_id, future in pending.items():
+            future.set_result({"jsonrpc": "2.0", "id": req_id, "error": {"code": -32000, "message": reason}})
+    
+    # the last lines a server wrote to stderr, oldest first
+    def stderr_tail(self, ser_name, lines=10):
+        return list(self.stderr_tails.get(ser_name, []))[-lines:]
+    
+    # round trips of a server's recent requests: {"count", "avg", "p50", "p95", "max"} in seconds
+    # method: only requests of this method, e.g. "tools/call"
+    def latency_stats(self, ser_name, method=None):
+        times = sorted(t for m, t in self.latencies.get(ser_name, []) if method in (None, m))
+        if not times:
+            return {"count": 0, "avg": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+        pick = lambda q: times[min(len(times) - 1, int(q * len(times)))]
+        return {"count": len(times), "avg": sum(times) / len(times), "p50": pick(0.5), "p95": pick(0.95), "max": times[-1]}
+    
+    # call callback(server name, message) for every notification of method ("*" for all of them)
+    # returns a function removing the subscription
+    def subscribe(self, method, callback):
+        self.subscribers.setdefault(method, []).append(callback)
+        return lambda: self.subscribers[method].remove(callback)
+    
+    # write one message to a server's stdin, False if it is not running or the pipe is closed
+    def write_msg(self, ser_name, msg):
+        process = self.processes.get(ser_name)
+        if process is None:
             print(f"[Warning] 服务 {ser_name} 还未运行")
+            return False
+        try:
+            data = (json.dumps(msg, ensure_ascii=False) + '\n').encode('utf-8')
+            with self.write_locks[ser_name]:
+                process.stdin.write(data)
+                process.stdin.flush()
+            return True
+        except Exception as e:
+            print(f"[Warning] 发送请求失败：{e}")
+            return False
+    
+    # send a request with a fresh id and wait for its response
+    # several requests to one server can be in flight at once, from any threads
+    # returns the response message, None on timeout or failure
+    def request(self, ser_name, method, params=None, timeout=3):
+        req_id = next(self.ids)
+        future = Future()
+        with self.pending_lock:
+            if ser_name not in self.pending:
+                print(f"[Warning] 服务 {ser_name} 还未运行")
+                return None
+            self.pending[ser_name][req_id] = future
+        
+        req = {"jsonrpc": "2.0", "id": req_id, "method": method, "params": params or {}}
+        start = time.time()
+        if not self.write_msg(ser_name, req):
+            with self.pending_lock:
+                self.pending.get(ser_name, {}).pop(req_id, None)
             return None
-        process = self.processes[ser_name]
         
         try:
-            # send request with one newline
-            req_json = json.dumps(req)
-            process.stdin.write(req_json + '\n')
-            process.stdin.flush()
-            
-            # 如果是通知（没有id字段），不等待响应
-            if 'id' not in req:
-                return None
-            
-            # 如果是请求（有id字段），等待响应
-            start_time = time.time()
-            while time.time() - start_time < timeout:
-                try:
-                    # 从队列获取响应
-                    line = self.output_queues[ser_name].get(timeout=0.1)
-                    if line and line.startswith('{'):
-                        try:
-                            resp = json.loads(line)
-                            # 检查ID是否匹配
-                            if 'id' in resp and resp['id'] == req['id']:
-                                return resp
-                        except:
-                            pass
-                except queue.Empty:
-                    continue
-            
-            print(f"[Warning] 请求超时: {req.get('method', 'unknown')}")
+            resp = future.result(timeout=timeout)
+            self.latencies[ser_name].append((method, time.time() - start))
+            return resp
+        except FutureTimeout:
+            with self.pending_lock:
+                self.pending.get(ser_name, {}).pop(req_id, None)
+            print(f"[Warning] 请求超时: {method}")
+            # let the server stop working on it
+            self.notify(ser_name, "notifications/cancelled", {"requestId": req_id, "reason": "timeout"})
             return None
-            
-        except Exception as e:
-            print(f"[Warning] 发送请求失败：{e}")
+    
+    # send a notification, no response is expected
+    def notify(self, ser_name, method, params=None):
+        return self.write_msg(ser_name, {"jsonrpc": "2.0", "method": method, "params": params or {}})
+    
+    # send a request or notification given as a whole message
+    # requests get a fresh id in place of theirs, returns the response (None for notifications)
+    def send_mcp_req(self, ser_name, req, timeout=3):
+        if 'id' not in req:
+            self.notify(ser_name, req['method'], req.get('params'))
             return None
+        return self.request(ser_name, req['method'], req.get('params'), timeout)
     
     def init_ser(self, ser_name):
         # initialize MCP server
+        # waits for the responses themselves, the server is ready once it answers 'initialize'
+        timeout = self.servers[ser_name].get("timeout", 30)
         
-        init_req = {
-            "jsonrpc": "2.0",
-            "id": 1,
-            "method": "initialize",
-            "params": {
-                "protocolVersion": "2025-01-05",
-                "clientInfo": {
-                    "name": "mcp-client",
-                    "version": "1.0.0"
-                },
-                "capabilities": {}
-            }
+        init_params = {
+            "protocolVersion": "2025-01-05",
+            "clientInfo": {
+                "name": "mcp-client",
+                "version": "1.0.0"
+            },
+            "capabilities": {}
         }
         
         print(f"[Debug] 发送初始化请求...")
-        resp = self.send_mcp_req(ser_name, init_req)
+        resp = self.request(ser_name, "initialize", init_params, timeout)
         
         if resp and 'result' in resp:
             print(f"[Debug] 初始化成功")
             
             # 发送initialized通知
-            init_notif = {
-                "jsonrpc": "2.0",
-                "method": "notifications/initialized",
-                "params": {}
-            }
-            
             print(f"[Debug] 发送initialized通知...")
-            self.send_mcp_req(ser_name, init_notif)
-            
-            time.sleep(0.5)
+            self.notify(ser_name, "notifications/initialized")
             
             # get工具列表
-            tools_req = {
-                "jsonrpc": "2.0",
-                "id": 2,
-                "method": "tools/list",
-                "params": {}
-            }
-            
             print(f"[Debug] 请求工具列表...")
-            tools_resp = self.send_mcp_req(ser_name, tools_req)
+            tools_resp = self.request(ser_name, "tools/list", timeout=timeout)
             
             if tools_resp and 'result' in tools_resp:
-                ser_tools = tools_resp['result'].get('tools', [])
-                self.tools[ser_name] = ser_tools
-                print(f"[Info] 服务器 {ser_name} 加载了 {len(ser_tools)} 个工具")
+                self.set_tools(ser_name, tools_resp['result'].get('tools', []))
                 return True
         else:
             print(f"[Debug] 初始化失败: {resp}")
         
         return False
     
-    def call_tool(self, ser_name, tool_name, args):
-        # call MCP tools
-        call_req = {
-            "jsonrpc": "2.0",
-            "id": 3,
-            "method": "tools/call",
-            "params": {
-                "name": tool_name,
-                "arguments": args
-            }
-        }
-        resp = self.send_mcp_req(ser_name, call_req)
+    # record the tools a server lists, and keep the tool cache up to date
+    def set_tools(self, ser_name, ser_tools):
+        self.tools[ser_name] = ser_tools
+        print(f"[Info] 服务器 {ser_name} 加载了 {len(ser_tools)} 个工具")
+        if self.tool_cache and self.tool_cache.put(self.servers[ser_name], ser_tools) \
+                and ser_name in self.ready_events:
+            print(f"[Info] 服务器 {ser_name} 的工具列表与缓存不同，已更新")
+            if self.on_tools_changed:
+                self.on_tools_changed(ser_name)
+    
+    def call_tool(self, ser_name, tool_name, args, timeout=60):
+        # call MCP tools, calls to one server may run concurrently
+        # a server still starting in the background is waited for
+        ready = self.ready_events.get(ser_name)
+        if ready and not ready.wait(self.servers[ser_name].get("timeout", 30)):
+            return {"error": f"工具调用失败：服务器 {ser_name} 尚未启动完成"}
+        if ser_name in self.broker_keys:
+            try:
+                return self.broker.call(self.broker_keys[ser_name], tool_name, args, timeout)
+            except RuntimeError as e:
+                return {"error": f"工具调用失败：{e}"}
+        resp = self.request(ser_name, "tools/call", {"name": tool_name, "arguments": args}, timeout)
         if resp and 'result' in resp:
             return resp['result']
+        if resp and 'error' in resp:
+            return {"error": f"工具调用失败：{resp['error'].get('message', resp['error'])}"}
         return {"error": "工具调用失败"}
     
-    def stop(self):
-        for ser_name, process in self.processes.items():
-            if process:
-                # 停止标志
-                if ser_name in self.stop_events:
-                    self.stop_events[ser_name].set()
-                
-                # 等待读取线程结束
-                if ser_name in self.read_threads:
-                    self.read_threads[ser_name].join(timeout=1)
-                
-                # 终止进程
+    # start and initialize servers (all configured ones by default) at the same time
+    # a server failing or timing out is stopped without holding up the others
+    # returns {server name: True if its tools are loaded}
+    def start_all(self, ser_names=None):
+        ser_names = list(self.servers) if ser_names is None else ser_names
+        results = {}
+        
+        def start_one(ser_name):
+            results[ser_name] = self.launch(ser_name)
+        
+        threads = [threading.Thread(target=start_one, args=(name,), daemon=True) for name in ser_names]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+    
+    # start and initialize one server, timed; stopped again if it fails
+    # with a broker the server is asked from it, and only started here if the broker fails
+    def launch(self, ser_name):
+        start = time.time()
+        if self.broker and not self.broker.closed and self.conf_path:
+            try:
+                key, tools = self.broker.acquire(self.conf_path, ser_name)
+                self.broker_keys[ser_name] = key
+                self.set_tools(ser_name, tools)
+                self.startup_times[ser_name] = time.time() - start
+                print(f"[Info] 服务器 {ser_name} 由 MCP 代理提供，用时 {self.startup_times[ser_name]:.2f}s")
+                return True
+            except RuntimeError as e:
+                print(f"[Warning] MCP 代理无法提供服务器 {ser_name}，改为本地启动：{e}")
+        ok = bool(self.start_ser(ser_name)) and self.init_ser(ser_name)
+        self.startup_times[ser_name] = time.time() - start
+        if ok:
+            print(f"[Info] 服务器 {ser_name} 就绪，用时 {self.startup_times[ser_name]:.2f}s")
+        else:
+            print(f"[Warning] 服务器 {ser_name} 启动失败，用时 {self.startup_times[ser_name]:.2f}s")
+            self.stop_ser(ser_name)
+        return ok
+    
+    # register the cached tools of a server at once and start it in the background
+    # calls to its tools wait until it is up, see call_tool
+    def warm_start(self, ser_name, tools):
+        self.tools[ser_name] = tools
+        ready = self.ready_events[ser_name] = threading.Event()
+        
+        def run():
+            try:
+                self.launch(ser_name)
+            finally:
+                ready.set()
+        threading.Thread(target=run, daemon=True).start()
+    
+    def stop_ser(self, ser_name):
+        # a server of the broker is only released, the broker stops it once nobody uses it
+        key = self.broker_keys.pop(ser_name, None)
+        if key:
+            try:
+                self.broker.release(key)
+            except RuntimeError:
+                pass
+        
+        process = self.processes.get(ser_name)
+        if process:
+            # 停止标志
+            if ser_name in self.stop_events:
+                self.stop_events[ser_name].set()
+            
+            # 终止进程
+            if process.poll() is None:
                 process.terminate()
                 try:
                     process.wait(timeout=3)
@@ -222,40 +577,64 @@ class MCPServerManager:
                 except:
                     process.kill()
                     print(f"[Warning] 强制停止服务器 '{ser_name}'")
+            
+            # 等待读取线程结束，进程退出后管道关闭，线程随之结束
+            if ser_name in self.read_threads:
+                self.read_threads[ser_name].join(timeout=1)
+    
+    def stop(self):
+        for ser_name in list(self.processes) + list(self.broker_keys):
+            self.stop_ser(ser_name)
 
 
-def load_mcp_conf(path, manager):
+def load_mcp_conf(path, manager, tool_cache=None):
     # load MCP config files and launch server
+    # with a ToolListCache, servers listed before are registered from it and warm up in the background
     
     try:
         with open(path, 'r') as f:
             conf = f.read()
         
         if manager.parse_config(conf):
+            manager.conf_path = os.path.abspath(path)
             print(f"[Info] 正在加载MCP配置文件 {os.path.basename(path)}")
             
             funcs = {}
             
+            # 有缓存的服务器在后台启动，其余服务器同时启动并等待就绪
+            manager.tool_cache = tool_cache
+            warm = {}
+            if tool_cache:
+                for ser_name, ser_conf in manager.servers.items():
+                    tools = tool_cache.get(ser_conf)
+                    if tools is not None:
+                        warm[ser_name] = tools
+            for ser_name, tools in warm.items():
+                print(f"[Info] 从缓存注册 {ser_name} 的 {len(tools)} 个工具，服务器在后台启动")
+                manager.warm_start(ser_name, tools)
+            ready = manager.start_all([name for name in manager.servers if name not in warm])
+            ready.update({name: True for name in warm})
             for ser_name in manager.servers.keys():
-                if manager.start_ser(ser_name):
-                    if manager.init_ser(ser_name):
-                        # 为每个工具创建函数
-                        for tool in manager.tools.get(ser_name, []):
-                            tool_name = tool.get('name', '')
-                            if tool_name:
-                                func_name = f"mcp_{ser_name}_{tool_name}"
-                                desc = tool.get('description', '无描述')
-                                
-                                # 使用闭包捕获当前值
-                                def create_tool_func(mgr, s_name, t_name, t_desc):
-                                    def tool_func(**kwargs):
-                                        res = mgr.call_tool(s_name, t_name, kwargs)
-                                        return json.dumps(res, ensure_ascii=False, indent=2)
-                                    tool_func.__name__ = t_name
-                                    tool_func.__doc__ = t_desc
-                                    return tool_func
-                                
-                                funcs[func_name] = create_tool_func(manager, ser_name, tool_name, desc)
+                if ready.get(ser_name):
+                    # 为每个工具创建函数
+                    for tool in manager.tools.get(ser_name, []):
+                        tool_name = tool.get('name', '')
+                        if tool_name:
+                            func_name = f"mcp_{ser_name}_{tool_name}"
+                            desc = tool.get('description', '无描述')
+                            
+                            # 使用闭包捕获当前值
+                            def create_tool_func(mgr, s_name, t_name, t_desc, t_schema):
+                                def tool_func(**kwargs):
+                                    res = mgr.call_tool(s_name, t_name, kwargs)
+                                    return json.dumps(res, ensure_ascii=False, indent=2)
+                                tool_func.__name__ = t_name
+                                tool_func.__doc__ = t_desc
+                                # 工具参数的JSON Schema，供函数调用模式使用
+                                tool_func.input_schema = t_schema
+                                return tool_func
+                            
+                            funcs[func_name] = create_tool_func(manager, ser_name, tool_name, desc, tool.get('inputSchema'))
             
             print(f"[Info] 加载了 {len(funcs)} 个MCP工具")
             return funcs
@@ -0,0 +1,64 @@
+import re
+import json
+
+
+# prefix of a reply holding a whole plan, see AI.run_plan
+PLAN_PREFIX = "YLDPLAN:"
+
+# ${N} in an arg is replaced by the result of step N (counted from 1)
+REF_PATTERN = re.compile(r"\$\{(\d+)\}")
+
+# how the model is told to write plans, added to the system prompt in plan mode
+PLAN_PROMPT = """
+        【计划模式】
+        - 需要按顺序执行多个工具的任务，可以一次输出整个计划，而不必每次只执行一步：
+          `YLDPLAN: [{"tool": "工具名", "args": ["参数1", "参数2"]}, {"tool": "工具名", "args": {"参数名": "${1}"}}]`
+        - args 可以是参数列表或参数字典；参数中的 ${N} 会被替换为第 N 步（从1开始）的执行结果
+        - 计划会在本地按顺序执行，某一步失败时停止，所有结果一次性返回
+        - 计划同样只能单独输出，前后不能有任何其他文本
+        - 使用计划时，"每次只执行一步"的规则不再适用
+"""
+
+
+# steps of a plan reply: [{"tool": str, "args": list | dict}]
+# raises ValueError with a message for the model if the plan is malformed
+def parse_plan(text):
+    body = text.strip()[len(PLAN_PREFIX):].strip()
+    # models like to wrap json in a code fence
+    body = re.sub(r"^```(?:json)?\s*|\s*```$", "", body)
+    try:
+        steps = json.loads(body)
+    except ValueError as e:
+        raise ValueError(f"计划不是合法的JSON：{e}")
+    if not isinstance(steps, list) or not steps:
+        raise ValueError("计划必须是非空的步骤列表")
+
+    plan = []
+    for i, step in enumerate(steps, 1):
+        if not isinstance(step, dict) or not isinstance(step.get("tool"), str):
+            raise ValueError(f"第 {i} 步缺少工具名 tool")
+        args = step.get("args", [])
+        if not isinstance(args, (list, dict)):
+            args = [args]
+        for n in map(int, REF_PATTERN.findall(json.dumps(args, ensure_ascii=False))):
+            if not 1 <= n < i:
+                raise ValueError(f"第 {i} 步引用了 ${{{n}}}，只能引用之前步骤的结果")
+        plan.append({"tool": step["tool"], "args": args})
+    return plan
+
+
+# args of a step with every ${N} replaced by the result of step N
+# an arg which is exactly one reference gets the result as is, otherwise it is substituted as text
+def resolve_refs(args, results):
+    def resolve(value):
+        if isinstance(value, str):
+            whole = REF_PATTERN.fullmatch(value.strip())
+            if whole:
+                return results[int(whole.group(1)) - 1]
+            return REF_PATTERN.sub(lambda m: str(results[int(m.group(1)) - 1]), value)
+        if isinstance(value, list):
+            return [resolve(v) for v in value]
+        if isinstance(value, dict):
+            return {k: resolve(v) for k, v in value.items()}
+        return value
+    return resolve(args)
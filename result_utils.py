@@ -0,0 +1,119 @@
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+# status prefixes put before tool results by AI.exec_func
+STATUS_PREFIXES = ("执行成功：", "执行失败：")
+
+
+# shapes tool results before they enter the conversation history:
+# MCP envelopes are reduced to their texts, every result is capped in size
+# oversized results are kept here, history only gets the head and a handle to page through
+# results within the cap reach the model as the tool returned them; only oversized ones get
+# json minified and repeated lines dropped, and file contents (verbatim) never do,
+# the model may write them back to disk
+class ResultShaper:
+    def __init__(self, max_chars=4000, max_stored=50):
+        # max_chars: default cap of one result in history, also the page size of read
+        # limits: {function name: chars}, caps of single tools
+        # verbatim: tools whose results are only ever cut, never rewritten
+        # max_stored: oversized results kept, the oldest ones are dropped
+        self.max_chars = max_chars
+        self.limits = {}
+        self.verbatim = {"cat", "find_lines_in_file"}
+        self.max_stored = max_stored
+        self.store = OrderedDict()
+        self.count = 0
+        # tools are shaped in pool threads, store and count are only touched under this lock
+        self.lock = threading.Lock()
+
+    # texts of an MCP result ({"content": [{"type": "text", "text": ...}]}) as they are,
+    # any other MCP result as compact json; None if text is not json
+    def unwrap(self, text):
+        try:
+            obj = json.loads(text)
+        except (ValueError, TypeError):
+            return None
+        if isinstance(obj, dict) and isinstance(obj.get("content"), list) and not obj.get("isError"):
+            texts = [c.get("text", "") for c in obj["content"] if isinstance(c, dict) and c.get("type") == "text"]
+            if len(texts) == len(obj["content"]):
+                return "\n".join(texts)
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+    # compact form of a json text, or None if text is not json
+    def minify(self, text):
+        try:
+            obj = json.loads(text)
+        except (ValueError, TypeError):
+            return None
+        if not isinstance(obj, (dict, list)):
+            return None
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+    # drop exactly repeated consecutive lines, blank runs become one blank line
+    def dedupe(self, text):
+        lines = []
+        for line in text.splitlines():
+            if lines and line == lines[-1]:
+                continue
+            lines.append(line)
+        return "\n".join(lines)
+
+    # keep an oversized result, returns its handle
+    # the same content always gets the same handle
+    def keep(self, text):
+        digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        with self.lock:
+            for handle, (d, _) in self.store.items():
+                if d == digest:
+                    self.store.move_to_end(handle)
+                    return handle
+            self.count += 1
+            handle = f"res_{self.count}"
+            self.store[handle] = (digest, text)
+            while len(self.store) > self.max_stored:
+                self.store.popitem(last=False)
+            return handle
+
+    # the shaped result of func_name: str
+    def shape(self, func_name, result):
+        result = str(result)
+        status = ""
+        for prefix in STATUS_PREFIXES:
+            if result.startswith(prefix):
+                status, result = prefix, result[len(prefix):]
+                break
+
+        if func_name.startswith("mcp_"):
+            result = self.unwrap(result) or result
+
+        limit = self.limits.get(func_name, self.max_chars)
+        if limit and len(result) > limit and func_name not in self.verbatim:
+            result = self.minify(result) or self.dedupe(result)
+        if limit and len(result) > limit:
+            handle = self.keep(result)
+            pages = -(-len(result) // self.max_chars)
+            result = (result[:limit] +
+                      f"\n…[结果过长已截断：共 {len(result)} 字符，{pages} 页。"
+                      f"完整内容编号 {handle}，可调用工具 read_result 按页读取，参数依次为 {handle} 和页码]")
+        return status + result
+
+    def read(self, handle: str, page: int = 1) -> str:
+        """
+        分页读取被截断的工具结果
+
+        Args:
+            handle: 截断提示中的完整内容编号，如 res_1
+            page: 页码，从1开始
+        """
+        with self.lock:
+            if handle not in self.store:
+                raise ValueError(f"结果 {handle} 不存在或已过期")
+            text = self.store[handle][1]
+        page = int(page)
+        pages = -(-len(text) // self.max_chars)
+        if not 1 <= page <= pages:
+            raise ValueError(f"页码超出范围，共 {pages} 页")
+        return f"[{handle} 第 {page}/{pages} 页]\n" + text[(page - 1) * self.max_chars: page * self.max_chars]
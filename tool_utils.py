@@ -0,0 +1,292 @@
+import os
+import re
+import json
+import math
+import time
+import typing
+import inspect
+import threading
+from collections import Counter
+
+
+# python annotations -> json schema types
+JSON_TYPES = {
+    str: "string",
+    int: "integer",
+    float: "number",
+    bool: "boolean",
+    list: "array",
+    tuple: "array",
+    dict: "object",
+}
+
+
+# json schema type of an annotation, Optional[X] and List[X] are reduced to X / list
+def json_type(annotation):
+    if annotation in JSON_TYPES:
+        return JSON_TYPES[annotation]
+    origin = typing.get_origin(annotation)
+    if origin in JSON_TYPES:
+        return JSON_TYPES[origin]
+    if origin is typing.Union:
+        args = [a for a in typing.get_args(annotation) if a is not type(None)]
+        if len(args) == 1:
+            return json_type(args[0])
+    # unannotated args are passed as text, the same as in YLDEXECUTE mode
+    return "string"
+
+
+# split a google style docstring into (summary, {arg name: description})
+def parse_doc(doc):
+    doc = inspect.cleandoc(doc or "")
+    summary_lines = []
+    arg_docs = {}
+    section = None
+    arg_indent = None
+    for line in doc.splitlines():
+        stripped = line.strip()
+        if re.match(r"^(Args|Arguments|Parameters|Returns|Return|Raises|Example|Examples)\s*:", stripped):
+            section = stripped.split(":")[0]
+            continue
+        if section is None:
+            if stripped:
+                summary_lines.append(stripped)
+        elif section in ("Args", "Arguments", "Parameters"):
+            # arg lines share the indent of the first one, other lines are continuations
+            indent = len(line) - len(line.lstrip())
+            match = re.match(r"^(\w+)\s*(\(.*?\))?\s*:\s*(.*)$", stripped)
+            if match and arg_indent in (None, indent):
+                arg_indent = indent
+                last_arg = match.group(1)
+                arg_docs[last_arg] = match.group(3)
+            elif stripped and arg_docs:
+                arg_docs[last_arg] = f"{arg_docs[last_arg]} {stripped}".strip()
+    return " ".join(summary_lines), arg_docs
+
+
+# function calling schema of one loaded tool
+# MCP tools carry the 'inputSchema' from tools/list in 'input_schema'
+# python tools are described by their signature and docstring
+def func_schema(func_name, func):
+    summary, arg_docs = parse_doc(func.__doc__)
+    schema = getattr(func, "input_schema", None)
+
+    if schema is None:
+        properties = {}
+        required = []
+        try:
+            params = inspect.signature(func).parameters.values()
+        except (TypeError, ValueError):
+            params = []
+        for param in params:
+            if param.kind in (param.VAR_POSITIONAL, param.VAR_KEYWORD):
+                continue
+            prop = {"type": json_type(param.annotation)}
+            if param.name in arg_docs:
+                prop["description"] = arg_docs[param.name]
+            if param.default is param.empty:
+                required.append(param.name)
+            else:
+                try:
+                    json.dumps(param.default)
+                    prop["default"] = param.default
+                except TypeError:
+                    pass
+            properties[param.name] = prop
+        schema = {"type": "object", "properties": properties, "required": required}
+
+    return {
+        "type": "function",
+        "function": {
+            "name": func_name,
+            "description": summary or "无描述",
+            "parameters": schema or {"type": "object", "properties": {}},
+        },
+    }
+
+
+# schemas of all loaded tools, passed as 'tools=' to the api
+def tools_schema(funcs):
+    return [func_schema(name, func) for name, func in funcs.items()]
+
+
+# json schema types -> short names used in compact descriptions
+SHORT_TYPES = {
+    "string": "str",
+    "integer": "int",
+    "number": "float",
+    "boolean": "bool",
+    "array": "list",
+    "object": "dict",
+}
+
+
+# first line of a docstring, cut to limit chars
+def summary_line(doc, limit=120):
+    lines = [line.strip() for line in inspect.cleandoc(doc or "").splitlines() if line.strip()]
+    if not lines:
+        return "无描述"
+    line = lines[0]
+    return line if len(line) <= limit else line[:limit - 1] + "…"
+
+
+# one-line description of a tool for the system prompt, built from its schema:
+# "name(arg: type, opt: type = default)：summary｜arg：description；..."
+# args keep their order, so YLDEXECUTE args can be given by position
+def compact_desc(func_name, func):
+    if getattr(func, "compact_desc", None):
+        return func.compact_desc
+    schema = func_schema(func_name, func)["function"]["parameters"]
+    _, arg_docs = parse_doc(func.__doc__)
+    required = schema.get("required", [])
+    params = []
+    notes = []
+    for name, prop in (schema.get("properties") or {}).items():
+        kind = prop.get("type")
+        param = f"{name}: {SHORT_TYPES.get(kind, kind)}" if isinstance(kind, str) else name
+        if "default" in prop:
+            # python tools show their defaults as the signature writes them, MCP tools as json
+            default = prop["default"]
+            param += f" = {json.dumps(default, ensure_ascii=False) if func_name.startswith('mcp_') else repr(default)}"
+        elif name not in required:
+            param += " = 可选"
+        params.append(param)
+        # MCP schemas carry their own descriptions
+        note = arg_docs.get(name) or prop.get("description")
+        if note:
+            notes.append(f"{name}：{note}")
+    desc = f"{func_name}({', '.join(params)})：{summary_line(func.__doc__)}"
+    return desc + ("｜" + "；".join(notes) if notes else "")
+
+
+# description of a tool in the "full" format: its docstring as written
+def full_desc(func_name, func):
+    return f"{func_name}: {func.__doc__ or '无描述'}"
+
+
+# stamp of a tool file, cached descriptions are valid while it is unchanged
+def file_stamp(path):
+    stat = os.stat(path)
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+
+# descriptions of the tools of every tool file, saved from a previous run
+# lets AI register tools without importing their modules or starting their servers
+# {path: {"stamp": file_stamp, "version", "tools": {func name: {"doc", "schema", "server", "compact"}}}}
+class DescCache:
+    # bumped when the cached descriptions are built differently, older entries are then rebuilt
+    VERSION = 2
+
+    def __init__(self, path=".cache/tool_desc.json"):
+        self.path = path
+        self.data = {}
+        self.changed = False
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    # cached tools of a tool file, None if missing or outdated
+    def get(self, tool_path):
+        entry = self.data.get(os.path.abspath(tool_path))
+        if entry and entry["stamp"] == file_stamp(tool_path) and entry.get("version") == self.VERSION:
+            return entry["tools"]
+        return None
+
+    def put(self, tool_path, funcs):
+        tools = {}
+        for name, func in funcs.items():
+            tools[name] = {
+                "doc": func.__doc__,
+                "schema": func_schema(name, func)["function"]["parameters"],
+                "server": getattr(func, "server", None),
+                "compact": compact_desc(name, func),
+            }
+        self.data[os.path.abspath(tool_path)] = {"stamp": file_stamp(tool_path), "version": self.VERSION, "tools": tools}
+        self.changed = True
+
+    def save(self):
+        if not self.changed:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(self.data, f, ensure_ascii=False)
+            self.changed = False
+        except OSError as e:
+            print(f"[Warning] 保存工具描述缓存失败：{e}")
+
+
+# loads the real tools behind LazyTools once, on the first call of any of them
+# load: returns {func name: function}; the time taken goes to timings as (label, seconds)
+class OnceLoader:
+    def __init__(self, load, label, timings):
+        self.load = load
+        self.label = label
+        self.timings = timings
+        self.funcs = None
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            if self.funcs is None:
+                start = time.time()
+                self.funcs = self.load() or {}
+                self.timings.append((self.label, time.time() - start))
+        return self.funcs
+
+
+# stands in for a tool whose module is not imported (or whose server is not started) yet
+# described from DescCache, the first call loads the real tool through its OnceLoader
+class LazyTool:
+    def __init__(self, func_name, doc, schema, loader, compact=None):
+        self.func_name = func_name
+        self.__name__ = func_name
+        self.__doc__ = doc
+        self.input_schema = schema
+        self.loader = loader
+        # compact_desc saved with the description, None to build it again
+        self.compact_desc = compact
+
+    def __call__(self, *args, **kwargs):
+        funcs = self.loader()
+        if self.func_name not in funcs:
+            raise RuntimeError(f"工具 {self.func_name} 加载失败")
+        return funcs[self.func_name](*args, **kwargs)
+
+
+# words of a text for ToolIndex
+# camelCase and snake_case names are split, chinese is indexed by single chars and char pairs
+def tokenize(text):
+    text = re.sub(r"([a-z])([A-Z])", r"\1 \2", text or "").lower()
+    tokens = re.findall(r"[a-z0-9]+", text)
+    for run in re.findall(r"[一-鿿]+", text):
+        tokens += list(run)
+        tokens += [run[i:i + 2] for i in range(len(run) - 1)]
+    return tokens
+
+
+# local BM25 index over tool names and descriptions, no network involved
+class ToolIndex:
+    def __init__(self, docs, k1=1.5, b=0.75):
+        # docs: {tool name: text describing it}
+        self.k1 = k1
+        self.b = b
+        self.docs = {name: Counter(tokenize(text)) for name, text in docs.items()}
+        self.lengths = {name: sum(tf.values()) for name, tf in self.docs.items()}
+        self.avg_len = sum(self.lengths.values()) / len(self.docs) if self.docs else 0
+        df = Counter(term for tf in self.docs.values() for term in tf)
+        n = len(self.docs)
+        self.idf = {term: math.log(1 + (n - f + 0.5) / (f + 0.5)) for term, f in df.items()}
+
+    def score(self, name, terms):
+        tf = self.docs[name]
+        norm = self.k1 * (1 - self.b + self.b * self.lengths[name] / (self.avg_len or 1))
+        return sum(self.idf[t] * tf[t] * (self.k1 + 1) / (tf[t] + norm) for t in terms if t in tf)
+
+    # names of the k tools most relevant to query, best first; tools matching nothing are left out
+    def search(self, query, k):
+        terms = set(tokenize(query))
+        scores = [(self.score(name, terms), name) for name in self.docs]
+        return [name for score, name in sorted(scores, key=lambda s: -s[0]) if score > 0][:k]
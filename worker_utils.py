@@ -0,0 +1,219 @@
+import os
+import sys
+import time
+import threading
+import importlib.util
+import multiprocessing
+
+from tool_utils import func_schema
+
+
+# python tool modules hosted in worker processes instead of the agent process
+# a slow or crashing tool then only blocks or takes down its worker:
+# calls go over a pipe, time out by killing the worker, and workers are recycled after max_calls
+
+
+# {func name: function} of a python tool file, the same tools AI.load_mcp_mod collects
+def import_tools(mcp_path):
+    module_name = os.path.basename(mcp_path).replace('.py', '')
+    spec = importlib.util.spec_from_file_location(module_name, mcp_path)
+    if spec is None:
+        raise ImportError(f"无法从 {mcp_path} 加载模块")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return {name: attr for name, attr in vars(module).items()
+            if callable(attr) and not name.startswith('_') and getattr(attr, '__module__', None) == module_name}
+
+
+# main loop of a worker process
+# requests: ("describe", path) or ("call", path, func name, args, kwargs), None to quit
+# replies: ("ok", value) or ("error", message), ("ready", pid) once on start
+def worker_main(conn):
+    # tool files imported so far: {path: funcs}
+    loaded = {}
+    conn.send(("ready", os.getpid()))
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        if request is None:
+            return
+
+        kind, path = request[:2]
+        try:
+            if path not in loaded:
+                loaded[path] = import_tools(path)
+            funcs = loaded[path]
+            if kind == "describe":
+                reply = ("ok", {name: describe(name, func) for name, func in funcs.items()})
+            else:
+                func_name, args, kwargs = request[2:]
+                if func_name not in funcs:
+                    raise NameError(f"函数 '{func_name}' 不存在")
+                reply = ("ok", funcs[func_name](*args, **kwargs))
+        except Exception as e:
+            reply = ("error", f"{type(e).__name__}: {e}")
+
+        try:
+            conn.send(reply)
+        except Exception:
+            # results that cannot be pickled are sent as text, they end up as text in conv_his anyway
+            conn.send((reply[0], str(reply[1])))
+
+
+# what the agent process needs to register a tool without importing it
+def describe(func_name, func):
+    info = {"doc": func.__doc__, "schema": func_schema(func_name, func)["function"]["parameters"]}
+    # cache_key functions cannot cross the pipe, tools using them are cached by args only
+    if isinstance(getattr(func, "cache_ttl", None), (int, float)):
+        info["cache_ttl"] = func.cache_ttl
+    return info
+
+
+# one worker process and the parent's end of its pipe
+# waits until the process is up, so starting it does not count against the timeout of a call
+class Worker:
+    def __init__(self, context, start_timeout=30):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=worker_main, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+        self.calls = 0
+        try:
+            ready = self.conn.poll(start_timeout) and self.conn.recv()[0] == "ready"
+        except (EOFError, OSError):
+            ready = False
+        if not ready:
+            self.stop(kill=True)
+            raise RuntimeError("工具进程启动失败")
+
+    def alive(self):
+        return self.process.is_alive()
+
+    # ask the worker to quit, kill it if it does not within grace seconds (or at once with kill)
+    def stop(self, kill=False, grace=1.0):
+        if not kill:
+            try:
+                self.conn.send(None)
+                self.process.join(grace)
+            except (OSError, ValueError):
+                pass
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+# stands in for a tool of a file hosted by WorkerPool, calling it runs the tool in a worker
+class WorkerTool:
+    def __init__(self, pool, mcp_path, func_name, info):
+        self.pool = pool
+        self.mcp_path = mcp_path
+        self.func_name = func_name
+        self.__name__ = func_name
+        self.__doc__ = info["doc"]
+        self.input_schema = info["schema"]
+        if info.get("cache_ttl"):
+            self.cache_ttl = info["cache_ttl"]
+
+    def __call__(self, *args, **kwargs):
+        return self.pool.call(self.mcp_path, self.func_name, args, kwargs)
+
+
+# pool of up to `workers` worker processes, started on demand and shared by all tool files
+# timeout: seconds allowed for one call, timeouts: {func name: seconds} overriding it
+#          (AI passes its tool_timeouts, so both stay in step)
+# max_calls: calls served by a worker before it is replaced, keeps leaks of tool modules bounded
+class WorkerPool:
+    def __init__(self, workers=None, timeout=60, timeouts=None, max_calls=200):
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.timeouts = timeouts if timeouts is not None else {}
+        self.max_calls = max_calls
+        # spawn on every platform: forking a process running threads (gui, tool pool) is unsafe
+        self.context = multiprocessing.get_context("spawn")
+        self.idle = []
+        self.slots = threading.Semaphore(self.workers)
+        self.lock = threading.Lock()
+        self.closed = False
+        self.stats = {"started": 0, "calls": 0, "timeouts": 0, "crashes": 0, "recycled": 0}
+
+    # an idle worker, or a new one if there is none; waits while all workers are busy
+    def acquire(self):
+        self.slots.acquire()
+        with self.lock:
+            while self.idle:
+                worker = self.idle.pop()
+                if worker.alive():
+                    return worker
+                worker.stop(kill=True)
+            self.stats["started"] += 1
+        try:
+            return Worker(self.context)
+        except Exception:
+            self.slots.release()
+            raise
+
+    def release(self, worker, broken=False):
+        broken = broken or not worker.alive()
+        recycle = not broken and worker.calls >= self.max_calls
+        with self.lock:
+            keep = not (broken or recycle or self.closed)
+            if keep:
+                self.idle.append(worker)
+            elif recycle:
+                self.stats["recycled"] += 1
+        # stopping may wait for the worker, other callers go on meanwhile
+        if recycle:
+            print(f"[Info] 工具进程已处理 {worker.calls} 次调用，将被替换")
+        if not keep:
+            worker.stop(kill=broken)
+        self.slots.release()
+
+    # send one request to a worker and wait for its reply at most timeout seconds
+    def request(self, message, timeout):
+        worker = self.acquire()
+        replied = False
+        try:
+            worker.conn.send(message)
+            worker.calls += 1
+            if worker.conn.poll(timeout):
+                status, value = worker.conn.recv()
+                replied = True
+        except (EOFError, OSError) as e:
+            # the worker died during the call, its exit code tells how
+            worker.process.join(1)
+            self.stats["crashes"] += 1
+            raise RuntimeError(f"工具进程异常退出（退出码 {worker.process.exitcode}）") from e
+        finally:
+            self.release(worker, broken=not replied)
+        if not replied:
+            self.stats["timeouts"] += 1
+            raise TimeoutError(f"超过 {timeout} 秒未完成，工具进程已结束")
+        if status == "error":
+            raise RuntimeError(value)
+        return value
+
+    # run a tool of mcp_path in a worker, raises RuntimeError / TimeoutError on failure
+    def call(self, mcp_path, func_name, args=(), kwargs=None):
+        self.stats["calls"] += 1
+        timeout = self.timeouts.get(func_name, self.timeout)
+        return self.request(("call", mcp_path, func_name, list(args), kwargs or {}), timeout)
+
+    # {func name: WorkerTool} of a python tool file, described by a worker
+    def load(self, mcp_path):
+        mcp_path = os.path.abspath(mcp_path)
+        start = time.time()
+        tools = self.request(("describe", mcp_path), self.timeout)
+        print(f"[Info] 在工具进程中加载 {os.path.basename(mcp_path)} 成功（{time.time() - start:.2f}s）")
+        return {name: WorkerTool(self, mcp_path, name, info) for name, info in tools.items()}
+
+    # stop every idle worker; busy ones are stopped when their call returns
+    def shutdown(self):
+        with self.lock:
+            self.closed = True
+            idle, self.idle = self.idle, []
+        for worker in idle:
+            worker.stop()